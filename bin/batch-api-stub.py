@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+batch-api-stub.py - Local stand-in for the Anthropic Message Batches API
+
+Serves just enough of the API for doc-ai-processor.py --batch (and plain
+requests, e.g. connection tests) to run against it (--base-url
+http://HOST:PORT), without an API key or costs:
+
+    POST /v1/messages                      one message, answered at once
+    POST /v1/messages/batches              create a batch (kept in memory)
+    GET  /v1/messages/batches/<id>         status: "in_progress" for the first
+                                           --polls checks, then "ended"
+    GET  /v1/messages/batches/<id>/results canned results, one JSONL line per request
+    GET  /stub/stats                       request counters, for test assertions
+
+Every request succeeds with a canned response: index requests (the
+"Index Generation Task" prompt, or a structured-output tool) get a small
+index in the schema doc-ai-processor.py asks for, combined requests both
+parts between their markers, "Respond with only: X" prompts X, all others
+a Markdown summary. Used by test-batch-api.sh and test-ai-server.sh.
+
+Usage:
+    batch-api-stub.py [--listen HOST:PORT] [--polls N]
+
+Exit codes:
+    0 - Stopped
+    1 - Error
+"""
+
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List
+
+
+SUMMARY_MARKER = "===BEGIN SUMMARY==="  # (as in doc-ai-processor.py)
+INDEX_MARKER = "===BEGIN INDEX JSON==="
+
+STUB_SUMMARY = """# Stub Summary
+
+## Overview
+
+Canned summary from batch-api-stub.py, the local stand-in for the batch API.
+It stands in for a real summary so the batch workflow can be tested offline.
+
+```mermaid
+flowchart LR
+    A[Submit] --> B[Poll] --> C[Results]
+```
+"""
+
+_BATCH_PATH = re.compile(r"^/v1/messages/batches/([\w-]+)(/results)?$")
+_SECTION = re.compile(r"^\*\*Section:\*\* (.*) \(([^()]*)\)$", re.MULTILINE)
+_RESPOND_WITH = re.compile(r"^Respond with only: (.*)$")
+
+
+def prompt_text(params: Dict[str, Any]) -> str:
+    """All text of a request's messages."""
+    parts = []
+    for message in params.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content or [])
+    return "\n".join(parts)
+
+
+def stub_index(prompt: str) -> Dict[str, Any]:
+    """A small index in the schema of the index prompt, for the section the prompt names."""
+    match = _SECTION.search(prompt)
+    title, section = match.groups() if match else ("Stub Section", "stub")
+    return {
+        "section": section,
+        "title": title,
+        "concepts": [{"name": "Stub Concept", "description": "Canned by batch-api-stub.py",
+                      "relevance": "high"}],
+        "terms": [{"term": "Stub", "definition": "A stand-in response", "context": section}],
+        "topics": [{"category": "Stub Topic", "subtopics": [title], "keywords": ["stub", section]}],
+        "patterns": {"how_to": [f"test {section} offline"], "what_is": ["a stub"],
+                     "troubleshooting": []},
+        "cross_refs": [{"from": "Stub Concept", "to": "Stub", "relationship": "uses"}]
+    }
+
+
+def canned_message(params: Dict[str, Any], n: int) -> Dict[str, Any]:
+    """A successful message for one batch request."""
+    prompt = prompt_text(params)
+    tools = params.get("tools") or []
+    if tools:
+        output = stub_index(prompt)
+        if "summary" in tools[0].get("input_schema", {}).get("properties", {}):
+            output = {"summary": STUB_SUMMARY, "index": output}
+        content = [{"type": "tool_use", "id": f"toolu_stub_{n}", "name": tools[0]["name"],
+                    "input": output}]
+    elif INDEX_MARKER in prompt:
+        content = [{"type": "text", "text": f"{SUMMARY_MARKER}\n{STUB_SUMMARY}\n{INDEX_MARKER}\n"
+                                            f"{json.dumps(stub_index(prompt), indent=2)}"}]
+    elif _RESPOND_WITH.match(prompt):
+        content = [{"type": "text", "text": _RESPOND_WITH.match(prompt).group(1)}]
+    elif "# Index Generation Task" in prompt:
+        content = [{"type": "text", "text": json.dumps(stub_index(prompt), indent=2)}]
+    else:
+        content = [{"type": "text", "text": STUB_SUMMARY}]
+    return {
+        "id": f"msg_stub_{n}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "stub"),
+        "content": content,
+        "stop_reason": "tool_use" if tools else "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": len(prompt_text(params)) // 4, "output_tokens": 200}
+    }
+
+
+class BatchStub:
+    """In-memory batches and request counters, shared by all handler threads."""
+    
+    def __init__(self, polls: int):
+        self.polls = polls
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"messages": 0, "batches_created": 0, "requests_submitted": 0,
+                      "status_checks": 0, "results_fetched": 0}
+        self.lock = threading.Lock()
+    
+    def message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            self.stats["messages"] += 1
+            n = self.stats["messages"]
+        return canned_message(params, n)
+    
+    def create(self, requests: List[Dict[str, Any]]) -> str:
+        with self.lock:
+            self.stats["batches_created"] += 1
+            self.stats["requests_submitted"] += len(requests)
+            batch_id = f"msgbatch_stub_{self.stats['batches_created']:04d}"
+            self.batches[batch_id] = {"requests": requests, "checks": 0, "created": time.time()}
+            return batch_id
+    
+    def describe(self, batch_id: str, base_url: str, count_check: bool = True) -> Dict[str, Any]:
+        with self.lock:
+            batch = self.batches[batch_id]
+            if count_check:
+                self.stats["status_checks"] += 1
+                batch["checks"] += 1
+            ended = batch["checks"] > self.polls
+            total = len(batch["requests"])
+            created = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(batch["created"]))
+            return {
+                "id": batch_id,
+                "type": "message_batch",
+                "processing_status": "ended" if ended else "in_progress",
+                "request_counts": {"processing": 0 if ended else total, "succeeded": total if ended else 0,
+                                   "errored": 0, "canceled": 0, "expired": 0},
+                "created_at": created,
+                "expires_at": created,
+                "ended_at": created if ended else None,
+                "archived_at": None,
+                "cancel_initiated_at": None,
+                "results_url": f"{base_url}/v1/messages/batches/{batch_id}/results" if ended else None
+            }
+    
+    def results(self, batch_id: str) -> str:
+        with self.lock:
+            self.stats["results_fetched"] += 1
+            requests = self.batches[batch_id]["requests"]
+        return "".join(json.dumps({
+            "custom_id": request["custom_id"],
+            "result": {"type": "succeeded", "message": canned_message(request["params"], n)}
+        }) + "\n" for n, request in enumerate(requests, 1))
+
+
+def make_handler(stub: BatchStub):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            print(f"stub: {format % args}", file=sys.stderr)
+        
+        def _send(self, status: int, body: str, content_type: str = "application/json"):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def _not_found(self):
+            self._send(404, json.dumps({"type": "error", "error": {
+                "type": "not_found_error", "message": f"Not found: {self.path}"}}))
+        
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            if path not in ("/v1/messages", "/v1/messages/batches"):
+                return self._not_found()
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if path == "/v1/messages":
+                return self._send(200, json.dumps(stub.message(body)))
+            batch_id = stub.create(body.get("requests", []))
+            self._send(200, json.dumps(stub.describe(batch_id, self._base_url(), count_check=False)))
+        
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/stub/stats":
+                with stub.lock:
+                    return self._send(200, json.dumps(stub.stats))
+            match = _BATCH_PATH.match(path)
+            if not match or match.group(1) not in stub.batches:
+                return self._not_found()
+            if match.group(2):
+                return self._send(200, stub.results(match.group(1)), "application/x-jsonl")
+            self._send(200, json.dumps(stub.describe(match.group(1), self._base_url())))
+        
+        def _base_url(self) -> str:
+            host, port = self.server.server_address[:2]
+            return f"http://{host}:{port}"
+    
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Anthropic Message Batches API (for tests)"
+    )
+    parser.add_argument("--listen", default="127.0.0.1:8766",
+                        help="host:port to listen on (default: 127.0.0.1:8766)")
+    parser.add_argument("--polls", type=int, default=1,
+                        help="Status checks answered with in_progress before a batch ends (default: 1)")
+    
+    args = parser.parse_args()
+    
+    host, _, port = args.listen.rpartition(":")
+    try:
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), make_handler(BatchStub(args.polls)))
+    except (OSError, ValueError) as e:
+        print(f"ERROR: Cannot listen on {args.listen}: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    print(f"Batch API stub listening on http://{args.listen}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
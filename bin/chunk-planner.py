@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+chunk-planner.py - Heading-aware chunk plan for a section's extracted text
+
+Detects headings in pdftotext output and splits the section into
+heading-aligned segments of whole pages, written as a JSON plan file. When
+a section is too long for one AI request, doc-ai-processor.py packs
+consecutive segments into chunks (--chunk-plan), so chunk boundaries fall on
+headings instead of cutting procedures and tables in half.
+
+Headings are found with font-independent heuristics ("Chapter N" markers,
+numbered headings, short title-case lines set off by blank lines) and, with
+--pdf, also by font size from `pdftotext -bbox` (lines set clearly larger
+than the page's body text).
+
+Usage:
+    chunk-planner.py <text-file> [--start-page N] [--pdf SOURCE_PDF] [--output PLAN]
+
+Plan format:
+    {
+      "version": 1,
+      "text_file": "...",
+      "start_page": 1,
+      "end_page": 460,
+      "segments": [
+        {"first_page": 1, "last_page": 14, "tokens": 9120, "level": 1, "heading": "Chapter 120 Color Page"}
+      ],
+      "headings": [{"page": 1, "level": 1, "text": "Chapter 120 Color Page"}]
+    }
+
+Exit codes:
+    0 - Success
+    1 - Error
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+from html import unescape
+from pathlib import Path
+from statistics import median
+from typing import Dict, Any, List, Optional, Set
+
+from siblings import load_sibling
+
+
+PLAN_VERSION = 1
+
+_CHAPTER = re.compile(r"(?:chapter|part)\s+\d+\b", re.IGNORECASE)
+_NUMBERED = re.compile(r"(\d+(?:\.\d+){0,3})\.?\s+[A-Z][^.!?]*")
+_WORD = re.compile(r"[A-Za-z][\w'’-]*")
+_MINOR_WORDS = {"a", "an", "and", "as", "at", "by", "for", "from", "in", "into", "of",
+                "on", "or", "the", "to", "vs", "with"}
+
+TOP_LINES = 5  # A heading among a page's first content lines starts a segment there
+FONT_SIZE_RATIO = 1.3  # With --pdf: lines this much taller than body text are headings
+
+
+def normalize_line(line: str) -> str:
+    """Compare lines ignoring spacing and case."""
+    return " ".join(line.split()).lower()
+
+
+def heading_level(line: str, previous: str, following: str) -> Optional[int]:
+    """Heading level of a text line (1 = chapter), or None if it isn't a heading."""
+    text = " ".join(line.split())
+    if not text or len(text) > 80:
+        return None
+    
+    if _CHAPTER.match(text):
+        return 1
+    
+    numbered = _NUMBERED.fullmatch(text)
+    if numbered and len(text.split()) <= 12:
+        return min(4, numbered.group(1).count(".") + 2)
+    
+    # Short title-case line set off by a blank line above
+    words = _WORD.findall(text)
+    if previous.strip() or not 1 <= len(words) <= 8 or text[-1] in ".,;:!?":
+        return None
+    if not following.strip() and len(words) == 1:
+        return None  # Lone words between blank lines are mostly labels and callouts
+    significant = [w for w in words if w.lower() not in _MINOR_WORDS]
+    if significant and all(w[0].isupper() for w in significant):
+        return 3
+    return None
+
+
+def font_headings(pdf: Path, first_page: int, last_page: int) -> Dict[int, Set[str]]:
+    """Lines set in a larger font than the body text, per page, from `pdftotext -bbox`."""
+    result = subprocess.run(
+        ["pdftotext", "-bbox", "-f", str(first_page), "-l", str(last_page), str(pdf), "-"],
+        capture_output=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"pdftotext -bbox failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+    
+    headings = {}
+    page_number = first_page - 1
+    for page in result.stdout.decode("utf-8", errors="replace").split("<page ")[1:]:
+        page_number += 1
+        lines: Dict[float, List[tuple]] = {}
+        for match in re.finditer(r'<word xMin="([\d.]+)" yMin="([\d.]+)" xMax="[\d.]+" '
+                                 r'yMax="([\d.]+)">(.*?)</word>', page):
+            x, y_min, y_max, word = float(match[1]), float(match[2]), float(match[3]), unescape(match[4])
+            lines.setdefault(round(y_max), []).append((x, y_max - y_min, word))
+        if not lines:
+            continue
+        
+        body_height = median(height for words in lines.values() for _, height, _ in words)
+        headings[page_number] = {
+            normalize_line(" ".join(word for _, _, word in sorted(words)))
+            for words in lines.values()
+            if median(height for _, height, _ in words) >= FONT_SIZE_RATIO * body_height
+        }
+    return headings
+
+
+def plan_segments(text: str, start_page: int, min_tokens: int,
+                  large_lines: Optional[Dict[int, Set[str]]] = None) -> Dict[str, Any]:
+    """Detect headings and split the pages into heading-aligned segments.
+    
+    A segment starts at every page with a chapter heading, or with any
+    heading among its first TOP_LINES content lines. Running headers and
+    footers are removed first, so they aren't taken for headings. A segment
+    smaller than min_tokens absorbs the ones after it until it is big enough.
+    """
+    processor = load_sibling("doc-ai-processor")
+    text, _ = processor.strip_running_lines(text)
+    pages = text.split("\f")
+    if pages and not pages[-1].strip():
+        pages.pop()  # pdftotext ends the last page with a form feed too
+    
+    headings = []
+    segments = []
+    for n, page in enumerate(pages, start_page):
+        lines = page.split("\n")
+        content_seen = 0
+        starts = None
+        for i, line in enumerate(lines):
+            if not line.strip():
+                continue
+            content_seen += 1
+            level = heading_level(line, lines[i - 1] if i else "",
+                                  lines[i + 1] if i + 1 < len(lines) else "")
+            if large_lines and normalize_line(line) in large_lines.get(n, ()):
+                level = min(level or 2, 2)
+            if level is None:
+                continue
+            
+            heading = {"page": n, "level": level, "text": " ".join(line.split())}
+            headings.append(heading)
+            if starts is None and (level == 1 or content_seen <= TOP_LINES):
+                starts = heading
+        
+        tokens = processor.estimate_tokens(page)
+        if starts is not None or not segments:
+            segments.append({"first_page": n, "last_page": n, "tokens": tokens,
+                             "level": starts["level"] if starts else None,
+                             "heading": starts["text"] if starts else None})
+        else:
+            segments[-1]["last_page"] = n
+            segments[-1]["tokens"] += tokens
+    
+    merged = []
+    for segment in segments:
+        if merged and merged[-1]["tokens"] < min_tokens:
+            merged[-1]["last_page"] = segment["last_page"]
+            merged[-1]["tokens"] += segment["tokens"]
+        else:
+            merged.append(segment)
+    
+    return {
+        "version": PLAN_VERSION,
+        "start_page": start_page,
+        "end_page": start_page + len(pages) - 1,
+        "segments": merged,
+        "headings": headings
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Heading-aware chunk plan for a section's extracted text"
+    )
+    parser.add_argument("text_file", type=Path, help="Extracted text (pdftotext, form feeds between pages)")
+    parser.add_argument("--start-page", type=int, default=1,
+                        help="Document page number of the text's first page (default: 1)")
+    parser.add_argument("--pdf", type=Path,
+                        help="Source PDF: also detect headings by font size (pdftotext -bbox)")
+    parser.add_argument("--min-tokens", type=int, default=2000,
+                        help="Merge segments smaller than this into their neighbour (default: 2000)")
+    parser.add_argument("--output", type=Path,
+                        help="Plan file to write (default: stdout)")
+    
+    args = parser.parse_args()
+    
+    if not args.text_file.exists():
+        print(f"ERROR: Text file not found: {args.text_file}", file=sys.stderr)
+        sys.exit(1)
+    
+    try:
+        text = args.text_file.read_text(encoding="utf-8", errors="replace")
+        
+        large_lines = None
+        if args.pdf:
+            try:
+                page_count = text.rstrip("\f").count("\f") + 1
+                large_lines = font_headings(args.pdf, args.start_page, args.start_page + page_count - 1)
+            except Exception as e:
+                print(f"WARNING: Font-size heading detection unavailable, using text heuristics: {e}",
+                      file=sys.stderr)
+        
+        plan = plan_segments(text, args.start_page, args.min_tokens, large_lines)
+        plan["text_file"] = args.text_file.as_posix()
+        print(f"Chunk plan: {len(plan['headings'])} heading(s), {len(plan['segments'])} segment(s) "
+              f"over pages {plan['start_page']}-{plan['end_page']}", file=sys.stderr)
+        
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(plan, f, indent=2)
+        else:
+            print(json.dumps(plan, indent=2))
+    
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,26 @@ Generates summaries, indexes, and diagrams from extracted text.
 """
 
 import argparse
+import contextvars
+import hashlib
 import json
 import os
+import random
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Any, Optional, Tuple
 import re
 from datetime import datetime
 
+from siblings import load_sibling
+
 # AI provider support
 try:
     import anthropic
@@ -26,19 +38,828 @@ try:
 except ImportError:
     OPENAI_AVAILABLE = False
 
+# Local tokenizer for token estimates (optional; a heuristic is used without it)
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Cross-process rate-limit state sharing (POSIX file locks)
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+
+# Prompt layout: every request for a section is
+#   system:  DOCUMENT_SYSTEM_PROMPT            (identical for all requests)
+#   user:    source block (section header + source text)  <- cacheable prefix
+#            task block (summary / index / combined instructions)
+# so the summary and index requests share everything up to the task block and
+# the provider can serve the large source text from its prompt cache.
+DOCUMENT_SYSTEM_PROMPT = """You are a technical documentation expert. You turn excerpts of technical documentation into artifacts optimized for LLM consumption: structured summaries and searchable indexes.
+
+The user message contains the source text first, followed by the task to perform on it. Follow the task instructions exactly."""
+
+SUMMARY_GUIDELINES = """Your task is to create a comprehensive, structured summary optimized for LLM consumption.
+
+Focus on:
+- Key concepts, workflows, and features
+- Glossary terms with precise definitions
+- Version-specific behaviors and caveats
+- Common pitfalls and troubleshooting
+- Hierarchical topic organization
+- Mermaid diagrams for visual concepts (workflows, hierarchies, state machines)
+
+Output format: Clean Markdown with semantic structure. Use headers, lists, tables, and code blocks appropriately."""
+
+INDEX_GUIDELINES = """You are creating a searchable index for LLM-based documentation retrieval. 
+
+Output must be valid JSON with:
+- concepts: list of key concepts with descriptions
+- terms: technical terms with context
+- topics: hierarchical topic clusters
+- patterns: user intent patterns (how-to, what-is, troubleshooting)
+- cross_refs: related concepts mentioned
+
+Be precise and comprehensive."""
+
+CHUNK_GUIDELINES = """Your task is to take notes on one part of a documentation section that is too long to process in a single request.
+
+The notes for all parts are combined afterwards to build the section's summary and index, so anything you leave out cannot be recovered later. Preserve:
+- Key concepts, features, tools and UI elements, by their exact names
+- Technical terms with their definitions
+- Procedures as numbered steps
+- Version-specific behaviors and caveats
+- Pitfalls and troubleshooting advice
+- References to other topics
+
+Output format: Dense, structured Markdown notes. No introduction or conclusion."""
+
+# Version of the page-notes prompt (CHUNK_GUIDELINES + the "chunk" task);
+# part of every page cache key, so bump it whenever that prompt changes
+PAGE_NOTES_VERSION = 1
+
+SUMMARY_MARKER = "===BEGIN SUMMARY==="
+INDEX_MARKER = "===BEGIN INDEX JSON==="
+
+# OpenAI has no assistant prefill, so a continuation is asked for explicitly
+CONTINUE_PROMPT = ("Your previous response was cut off by the output limit. Continue exactly where "
+                   "it stopped, without repeating anything and without any preamble.")
+TRUNCATED_STOP_REASONS = ("max_tokens", "length")
+
+
+def _strict_object(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON schema object with every property required and no others
+    (the form OpenAI's strict structured outputs require)."""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+
+def _string_list() -> Dict[str, Any]:
+    return {"type": "array", "items": {"type": "string"}}
+
+
+# JSON repair (see AIProcessor.repair_json_with_model): characters of context
+# sent on either side of a parse error, instead of the whole response
+JSON_REPAIR_CONTEXT = 600
+JSON_REPAIR_SYSTEM_PROMPT = "You fix syntax errors in JSON excerpts. You output only the corrected excerpt."
+
+# The index structure documented in _index_task, for structured output
+# (--structured-index): Anthropic tool input schema / OpenAI json_schema
+INDEX_SCHEMA = _strict_object({
+    "section": {"type": "string"},
+    "title": {"type": "string"},
+    "concepts": {"type": "array", "items": _strict_object({
+        "name": {"type": "string"},
+        "description": {"type": "string"},
+        "relevance": {"type": "string", "enum": ["high", "medium", "low"]}
+    })},
+    "terms": {"type": "array", "items": _strict_object({
+        "term": {"type": "string"},
+        "definition": {"type": "string"},
+        "context": {"type": "string"}
+    })},
+    "topics": {"type": "array", "items": _strict_object({
+        "category": {"type": "string"},
+        "subtopics": _string_list(),
+        "keywords": _string_list()
+    })},
+    "patterns": _strict_object({
+        "how_to": _string_list(),
+        "what_is": _string_list(),
+        "troubleshooting": _string_list()
+    }),
+    "cross_refs": {"type": "array", "items": _strict_object({
+        "from": {"type": "string"},
+        "to": {"type": "string"},
+        "relationship": {"type": "string"}
+    })}
+})
+
+# Combined mode with structured output: both outputs in one object
+COMBINED_SCHEMA = _strict_object({
+    "summary": {"type": "string"},
+    "index": INDEX_SCHEMA
+})
+
+# Name of the tool Anthropic is made to call with the structured output
+OUTPUT_TOOL = "record_output"
+
+
+# Context window sizes (tokens) by model name prefix; the longest matching
+# prefix wins. Override with --context-window for anything not listed.
+MODEL_CONTEXT_WINDOWS = {
+    "claude": 200000,
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-5": 400000,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+
+# Heuristic token pieces: letter runs, short digit groups, punctuation,
+# newlines and runs of layout spaces (see estimate_tokens)
+_TOKEN_PIECES = re.compile(r"[^\W\d_]+|\d{1,3}|\n+| {2,}|[^\w\s]")
+_tiktoken_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in text, locally.
+    
+    Uses tiktoken (cl100k_base) when installed. Otherwise approximates a BPE
+    tokenizer: about 1 token per 6 letters of a word, per 3-digit group, per
+    punctuation mark and per newline run, and 1 per 8 characters of space
+    runs (pdftotext layout padding), which tracks real counts far better
+    than a fixed chars-per-token ratio on layout-heavy text.
+    """
+    global _tiktoken_encoding
+    if TIKTOKEN_AVAILABLE:
+        if _tiktoken_encoding is None:
+            _tiktoken_encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_tiktoken_encoding.encode(text, disallowed_special=()))
+    
+    tokens = 0
+    for piece in _TOKEN_PIECES.findall(text):
+        if piece[0] == " ":
+            tokens += 1 + len(piece) // 8
+        elif piece[0].isalpha():
+            tokens += 1 + (len(piece) - 1) // 6
+        else:
+            tokens += 1
+    return tokens
+
+
+def context_window_for(model: str) -> int:
+    """Context window size of a model, from MODEL_CONTEXT_WINDOWS."""
+    matches = [prefix for prefix in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)]
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_WINDOW
+
+
+# Statistics for the AI calls made on behalf of one section. process_section
+# installs a fresh CallStats here; call_ai records into whichever is current.
+_call_stats: contextvars.ContextVar = contextvars.ContextVar("call_stats", default=None)
+
+
+class CallStats:
+    """Thread-safe counters for the AI calls made for one section."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+    
+    def add(self, **counts: int):
+        with self._lock:
+            for key, value in counts.items():
+                self._counts[key] = self._counts.get(key, 0) + value
+    
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+class ResponseCache:
+    """Content-addressed on-disk cache of AI responses.
+    
+    Entries are JSON files under <cache_dir>/<key[:2]>/<key>.json, keyed by a
+    hash of everything that determines the completion. A hit refreshes the
+    entry's mtime, so evicting oldest-mtime-first is least-recently-used.
+    Entries older than max_age_days are dropped; beyond max_bytes the least
+    recently used entries go first. The directory is scanned on open; after
+    that, writes keep a running total and only a total over max_bytes
+    triggers another scan, which trims down to EVICT_TO of max_bytes.
+    """
+    
+    EVICT_TO = 0.9  # Eviction frees this much headroom, so scans stay rare
+    
+    def __init__(self, cache_dir: Path, max_bytes: int = 512 * 1024 * 1024,
+                 max_age_days: float = 30.0, refresh: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.refresh = refresh  # Ignore existing entries (but still store new ones)
+        self._lock = threading.Lock()
+        self._bytes = 0  # Size of the cache as of the last scan, plus later writes
+        
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.evict()
+    
+    @staticmethod
+    def make_key(**fields: Any) -> str:
+        """Hash the request fields into a cache key."""
+        payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for key, or None."""
+        if self.refresh:
+            return None
+        
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age:
+                path.unlink()
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # Mark as recently used
+            return entry
+        except (OSError, ValueError):
+            return None
+    
+    def put(self, key: str, entry: Dict[str, Any]):
+        """Store an entry (atomically); evict once the cache outgrows max_bytes."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        size = tmp_path.stat().st_size
+        try:
+            size -= path.stat().st_size  # Replacing an entry
+        except OSError:
+            pass
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._bytes += size
+            full = self._bytes > self.max_bytes
+        if full:
+            self.evict()
+    
+    def evict(self):
+        """Drop expired entries; if the rest exceeds max_bytes, drop least
+        recently used ones until under EVICT_TO of max_bytes."""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for path in self.cache_dir.glob("*/*.json"):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.max_age:
+                    path.unlink(missing_ok=True)
+                else:
+                    entries.append((st.st_mtime, st.st_size, path))
+            
+            total = sum(size for _, size, _ in entries)
+            limit = self.max_bytes * self.EVICT_TO if total > self.max_bytes else self.max_bytes
+            for _, size, path in sorted(entries):
+                if total <= limit:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+            self._bytes = total
+
+
+class RateLimiter:
+    """Token-bucket limiter for requests, input tokens and output tokens per minute.
+    
+    Buckets start from the configured limits (unset = not limited until known)
+    and follow whatever the provider reports in its rate-limit response headers:
+    the reported limit sets bucket size and refill rate, the reported remaining
+    count corrects the local level. A retry-after pauses every caller (for at
+    most MAX_PAUSE seconds). Callers are held to `headroom` of each limit so
+    they stay just under it.
+    
+    State is shared by all threads using the instance and, through a small JSON
+    state file guarded by an exclusive file lock, by other processes using the
+    same file (POSIX only; elsewhere the limiter is per-process).
+    """
+    
+    MAX_PAUSE = 60.0  # Longest pause a retry-after header can impose
+    
+    # Response headers: bucket -> (limit header, remaining header)
+    HEADERS = {
+        "anthropic": {
+            "requests": ("anthropic-ratelimit-requests-limit", "anthropic-ratelimit-requests-remaining"),
+            "input_tokens": ("anthropic-ratelimit-input-tokens-limit", "anthropic-ratelimit-input-tokens-remaining"),
+            "output_tokens": ("anthropic-ratelimit-output-tokens-limit", "anthropic-ratelimit-output-tokens-remaining")
+        },
+        # OpenAI reports a single tokens-per-minute budget: tracked as input tokens
+        "openai": {
+            "requests": ("x-ratelimit-limit-requests", "x-ratelimit-remaining-requests"),
+            "input_tokens": ("x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens")
+        }
+    }
+    
+    def __init__(self, provider: str, state_file: Optional[Path] = None,
+                 limits: Optional[Dict[str, Optional[float]]] = None, headroom: float = 0.95):
+        self.provider = provider
+        self.state_file = state_file if FCNTL_AVAILABLE else None
+        self.headroom = headroom
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {"buckets": {}, "blocked_until": 0.0}
+        
+        now = time.time()
+        for name, limit in (limits or {}).items():
+            if limit:
+                self._state["buckets"][name] = {"limit": float(limit), "level": float(limit) * headroom,
+                                                "updated": now}
+    
+    @contextmanager
+    def _shared_state(self):
+        """Yield the limiter state for update, locked across threads and processes."""
+        with self._lock:
+            if self.state_file is None:
+                yield self._state
+                return
+            
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.state_file, "a+", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read() or "{}")
+                    except ValueError:
+                        state = {}
+                    state.setdefault("buckets", {})
+                    state.setdefault("blocked_until", 0.0)
+                    # Limits configured here fill in buckets nobody has reported yet
+                    for name, bucket in self._state["buckets"].items():
+                        state["buckets"].setdefault(name, bucket)
+                    
+                    yield state
+                    
+                    self._state = state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def _refill(self, state: Dict[str, Any], now: float):
+        for bucket in state["buckets"].values():
+            capacity = bucket["limit"] * self.headroom
+            elapsed = max(0.0, now - bucket["updated"])
+            bucket["level"] = min(capacity, bucket["level"] + elapsed * bucket["limit"] / 60.0)
+            bucket["updated"] = now
+    
+    def acquire(self, cost: Dict[str, float]) -> float:
+        """Block until every bucket can cover cost, then deduct it.
+        
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._shared_state() as state:
+                now = time.time()
+                self._refill(state, now)
+                
+                wait = max(0.0, state["blocked_until"] - now)
+                for name, amount in cost.items():
+                    bucket = state["buckets"].get(name)
+                    if bucket is None:
+                        continue
+                    # A request bigger than the whole bucket only waits for a full one
+                    needed = min(amount, bucket["limit"] * self.headroom)
+                    if bucket["level"] < needed:
+                        wait = max(wait, (needed - bucket["level"]) * 60.0 / bucket["limit"])
+                
+                if wait <= 0:
+                    for name, amount in cost.items():
+                        if name in state["buckets"]:
+                            state["buckets"][name]["level"] -= amount
+                    return waited
+            
+            wait = min(wait, 60.0)
+            time.sleep(wait)
+            waited += wait
+    
+    def settle(self, adjustments: Dict[str, float]):
+        """Correct buckets once actual usage is known (actual minus estimated)."""
+        with self._shared_state() as state:
+            for name, delta in adjustments.items():
+                bucket = state["buckets"].get(name)
+                if bucket is not None and delta:
+                    bucket["level"] = min(bucket["limit"] * self.headroom, bucket["level"] - delta)
+    
+    def update_from_headers(self, headers: Any):
+        """Adopt the limits, remaining counts and retry-after a response reported."""
+        if headers is None:
+            return
+        
+        reported = {}
+        for name, (limit_header, remaining_header) in self.HEADERS.get(self.provider, {}).items():
+            try:
+                limit = float(headers.get(limit_header))
+                remaining = float(headers.get(remaining_header))
+            except (TypeError, ValueError):
+                continue
+            if limit > 0:
+                reported[name] = (limit, remaining)
+        
+        retry_after = parse_retry_after(headers)
+        if not reported and retry_after is None:
+            return
+        
+        with self._shared_state() as state:
+            now = time.time()
+            self._refill(state, now)
+            for name, (limit, remaining) in reported.items():
+                bucket = state["buckets"].setdefault(name, {"limit": limit, "level": limit * self.headroom,
+                                                            "updated": now})
+                bucket["limit"] = limit
+                bucket["level"] = min(bucket["level"], remaining - limit * (1 - self.headroom))
+            if retry_after is not None:
+                state["blocked_until"] = max(state["blocked_until"], now + min(retry_after, self.MAX_PAUSE))
+
+
+def parse_retry_after(headers: Any) -> Optional[float]:
+    """Seconds to wait according to retry-after(-ms) response headers, if present."""
+    if headers is None:
+        return None
+    
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error: Exception) -> Tuple[bool, str]:
+    """Classify an API error as (retryable, reason).
+    
+    Retryable: rate limiting (429), overload (529), other 5xx, request
+    timeouts, connection failures, and streams aborted as malformed JSON.
+    
+    Fatal: authentication/permission (401/403), unknown model (404), invalid
+    requests (400/413/422), exhausted credit or quota, and anything that
+    isn't an API error at all.
+    """
+    if isinstance(error, MalformedResponseError):
+        return True, "malformed_json"  # Aborted mid-stream (see JSONStreamValidator)
+    
+    message = str(error).lower()
+    if "credit balance" in message or "insufficient_quota" in message:
+        return False, "insufficient_credit"
+    
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        if status == 429:
+            return True, "rate_limited"
+        if status == 529 or "overloaded" in message:
+            return True, "overloaded"
+        if status == 408:
+            return True, "timeout"
+        if status >= 500:
+            return True, "server_error"
+        if status == 401:
+            return False, "authentication"
+        if status == 403:
+            return False, "permission"
+        if status == 404:
+            return False, "not_found"
+        return False, f"http_{status}"
+    
+    # No HTTP status: transport-level failure (SDK or httpx error classes)
+    name = type(error).__name__
+    if isinstance(error, TimeoutError) or "Timeout" in name:
+        return True, "timeout"
+    if isinstance(error, ConnectionError) or "Connection" in name or "RemoteProtocol" in name:
+        return True, "connection"
+    # Mid-stream error events (e.g. overloaded_error) carry no HTTP status
+    if "overloaded" in message:
+        return True, "overloaded"
+    
+    return False, name
+
+
+class MalformedResponseError(Exception):
+    """A streamed response that can no longer become valid JSON (see JSONStreamValidator)."""
+    
+    received = ""  # Text streamed before the abort (set by AIProcessor._stream_provider)
+
+
+JSON_MAX_PREAMBLE = 200  # Characters allowed before a streamed index's opening brace
+JSON_MAX_ABORTS = 2  # Streams aborted as malformed before one is received whole (and repaired)
+_JSON_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_JSON_LITERALS = ("true", "false", "null")
+
+
+class JSONStreamValidator:
+    """Incremental check that a streamed response is becoming one JSON object.
+    
+    feed() takes text deltas as they arrive and raises MalformedResponseError
+    as soon as the output can no longer be parsed, even after repair: more
+    than max_preamble characters before the opening brace (a code fence or a
+    short lead-in is fine), or a character the JSON grammar doesn't allow
+    where it appears. Faults repair_json fixes after the fact (trailing
+    commas, raw control characters in strings) are let through. Whatever
+    follows the closed object is ignored, as parse_index does. With marker
+    set, everything up to the marker is skipped first (the index part of a
+    combined response).
+    """
+    
+    def __init__(self, max_preamble: int = JSON_MAX_PREAMBLE, marker: Optional[str] = None):
+        self.max_preamble = max_preamble
+        self.marker = marker
+        self._before_marker = ""  # Tail of the text before the marker, until it is seen
+        self._stack: List[str] = []  # Open containers: "{" or "["
+        self._expect = "start"
+        self._in_string = False
+        self._is_key = False
+        self._escape = False
+        self._literal = ""
+        self.checked = 0  # Characters validated so far
+    
+    @property
+    def complete(self) -> bool:
+        return self._expect == "done"
+    
+    def _fail(self, char: str):
+        raise MalformedResponseError(f"Malformed JSON at character {self.checked}: "
+                                     f"unexpected {char!r} (expected {self._expect.replace('_', ' ')})")
+    
+    def feed(self, delta: str):
+        """Validate the next piece of the response."""
+        if self.marker is not None:
+            text = self._before_marker + delta
+            found = text.find(self.marker)
+            if found < 0:
+                self._before_marker = text[-len(self.marker):]
+                return
+            delta = text[found + len(self.marker):]
+            self.marker = None
+        for char in delta:
+            if self._expect == "done":
+                return
+            self._feed_char(char)
+            self.checked += 1
+    
+    def _value_start(self, char: str):
+        if char == '"':
+            self._in_string, self._is_key = True, False
+        elif char == "{":
+            self._stack.append("{")
+            self._expect = "key_or_end"
+        elif char == "[":
+            self._stack.append("[")
+            self._expect = "value_or_end"
+        elif char in "-0123456789tfn":
+            self._literal = char
+        else:
+            self._fail(char)
+    
+    def _end_literal(self):
+        literal, self._literal = self._literal, ""
+        if literal not in _JSON_LITERALS and not _JSON_NUMBER.fullmatch(literal):
+            raise MalformedResponseError(f"Malformed JSON at character {self.checked}: "
+                                         f"invalid value {literal!r}")
+        self._expect = "comma_or_end"
+    
+    def _feed_char(self, char: str):
+        if self._in_string:
+            if self._escape:
+                if char not in '"\\/bfnrtu':
+                    raise MalformedResponseError(f"Malformed JSON at character {self.checked}: "
+                                                 f"invalid escape '\\{char}'")
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                self._expect = "colon" if self._is_key else "comma_or_end"
+            return  # (raw control characters are escaped by repair_json)
+        
+        if self._literal:
+            if char.isalnum() or char in "+-.":
+                self._literal += char
+                if self._literal[0].isalpha() and not any(l.startswith(self._literal) for l in _JSON_LITERALS):
+                    self._fail(char)
+                return
+            self._end_literal()
+        
+        if char in " \t\r\n":
+            return
+        
+        expect = self._expect
+        if expect == "start":
+            if char == "{":
+                self._stack.append("{")
+                self._expect = "key_or_end"
+            elif self.checked >= self.max_preamble:
+                raise MalformedResponseError(f"No JSON object after {self.checked} characters of preamble")
+        elif expect == "key_or_end":
+            if char == '"':
+                self._in_string, self._is_key = True, True
+            elif char == "}":
+                self._close(char)
+            else:
+                self._fail(char)
+        elif expect == "colon":
+            if char != ":":
+                self._fail(char)
+            self._expect = "value"
+        elif expect == "value_or_end" and char == "]":
+            self._close(char)
+        elif expect in ("value", "value_or_end"):
+            self._value_start(char)
+        elif expect == "comma_or_end":
+            if char == ",":
+                # A trailing comma may still be followed by the closing bracket
+                # (repair_json drops it)
+                self._expect = "key_or_end" if self._stack[-1] == "{" else "value_or_end"
+            elif char in "}]":
+                self._close(char)
+            else:
+                self._fail(char)
+    
+    def _close(self, char: str):
+        if self._stack.pop() != ("{" if char == "}" else "["):
+            self._fail(char)
+        self._expect = "comma_or_end" if self._stack else "done"
+
+
+def repair_json(text: str) -> Optional[Any]:
+    """Parse JSON from text after local repairs; None if that isn't enough.
+    
+    Repairs: text before the first brace is dropped, raw control characters
+    in strings are escaped, trailing commas are removed, and output that
+    stops early is completed: an unterminated string value is closed, and
+    unclosed arrays and objects are cut after their last complete value and
+    closed. Mistakes in the middle of the JSON are left to
+    AIProcessor.repair_json_with_model.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    
+    out: List[str] = []
+    stack: List[str] = []
+    cut = None  # (length of out, open containers) after the last complete value
+    in_string = is_key = escape = False
+    literal = False
+    literal_start = 0
+    last = ""  # Last significant character outside strings
+    for char in text[start:]:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+                if not is_key:
+                    cut = (len(out) + 1, list(stack))
+                last = '"'
+            elif char < " ":
+                char = json.dumps(char)[1:-1]
+            out.append(char)
+            continue
+        
+        if literal and not (char.isalnum() or char in "+-."):
+            literal = False
+            cut = (len(out), list(stack))
+        
+        if char == '"':
+            in_string = True
+            is_key = bool(stack) and stack[-1] == "{" and last in "{,"
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]":
+            if out and last == ",":
+                # Trailing comma: drop it (and the whitespace after it)
+                while out[-1] != ",":
+                    out.pop()
+                out.pop()
+            if not stack:
+                break
+            stack.pop()
+            out.append(char)
+            if not stack:
+                break  # Complete object; ignore whatever follows
+            cut = (len(out), list(stack))
+            last = char
+            continue
+        elif char not in " \t\r\n,:" and not literal:
+            literal = True
+            literal_start = len(out)
+        if char not in " \t\r\n":
+            last = char
+        out.append(char)
+    
+    if literal and stack:
+        value = "".join(out[literal_start:])
+        if value in _JSON_LITERALS or _JSON_NUMBER.fullmatch(value):
+            cut = (len(out), list(stack))  # (a number or literal that ended with the text)
+    
+    cuts = [cut]
+    if in_string and not is_key and stack:
+        # Stopped inside a string value: close it (minus any cut-off escape
+        # sequence), making it the last complete value
+        value = "".join(out[cut[0] if cut else 0:])
+        partial = re.search(r"(\\+)(u[0-9a-fA-F]{0,3})?$", value)
+        if partial and len(partial.group(1)) % 2:  # (not an escaped backslash)
+            value = value[:partial.end(1) - 1]
+        out = out[:cut[0] if cut else 0] + list(value) + ['"']
+        cuts.insert(0, (len(out), list(stack)))
+    
+    candidates = ["".join(out)]
+    for cut in cuts:
+        if stack and cut is not None:
+            length, open_containers = cut
+            candidates.append("".join(out[:length]) + "".join(
+                "}" if c == "{" else "]" for c in reversed(open_containers)))
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    return None
+
 
 class AIProcessor:
     """Handles AI-powered document processing."""
     
     def __init__(self, provider: str = "anthropic", model: Optional[str] = None, 
-                 max_tokens: int = 4096, temperature: float = 0.0):
+                 max_tokens: int = 4096, temperature: float = 0.0, combined: bool = False,
+                 prompt_cache: bool = False, base_url: Optional[str] = None,
+                 stream: bool = False, max_retries: int = 5,
+                 chunk_tokens: Optional[int] = None, chunk_concurrency: int = 4,
+                 context_window: Optional[int] = None, context_fraction: float = 0.6,
+                 count_tokens: bool = False, page_block: int = 8, normalize: bool = True,
+                 max_continuations: int = 3, structured_index: bool = False,
+                 json_repair_rounds: int = 2):
         self.provider = provider.lower()
         self.model = model
+        self.base_url = base_url  # API endpoint override (proxies, local stand-in servers)
         self.max_tokens = max_tokens
         self.temperature = temperature
+        self.combined = combined  # Summary + index in one request (see generate_combined)
+        self.structured_index = structured_index  # Index through structured output (see output_schema)
+        self.json_repair_rounds = json_repair_rounds  # Model requests to fix a broken index (see repair_json_with_model)
+        self.prompt_cache = prompt_cache  # Anthropic cache_control breakpoint on the source block
+        self.stream = stream  # Stream responses (see _stream_provider)
+        self.normalize = normalize  # Strip layout noise from the source text (see normalize_text)
+        self.chunk_tokens = chunk_tokens  # Chunk size cap for map-reduce (default: the input budget)
+        self.chunk_concurrency = chunk_concurrency  # Parallel chunk requests per section
+        self.context_fraction = context_fraction  # Share of the context window a request may fill
+        self.count_tokens = count_tokens  # Ask the provider for exact counts (see count_source_tokens)
+        self._token_ratio = 1.0  # Actual / estimated input tokens, learned from responses
+        self.cache: Optional[ResponseCache] = None  # Set by the caller to enable response caching
+        self.page_cache: Optional[ResponseCache] = None  # Set by the caller to cache page-block notes
+        self.page_block = page_block  # Pages per page-cache block (blocks align to document pages)
+        self.index_format = "json"  # Set by the caller: index file encoding (see write_section_outputs)
+        self.rate_limiter: Optional[RateLimiter] = None  # Set by the caller to pace requests
+        self._output_estimate = 2048.0  # Running average of output tokens per response
+        self.max_retries = max_retries  # Retries for transient errors (see _send)
+        self.max_continuations = max_continuations  # Follow-up requests for a response cut off at max_tokens
+        self.retry_base = 2.0  # First backoff ceiling in seconds, doubled per attempt...
+        self.retry_cap = 60.0  # ...up to this
         self.client = None
         
         self._setup_client()
+        self.context_window = context_window or context_window_for(self.model)
     
     def _setup_client(self):
         """Initialize AI client based on provider."""
@@ -50,7 +871,8 @@ class AIProcessor:
             if not api_key:
                 raise RuntimeError("ANTHROPIC_API_KEY environment variable not set")
             
-            self.client = anthropic.Anthropic(api_key=api_key)
+            # max_retries=0: retries are handled (and classified) by _send
+            self.client = anthropic.Anthropic(api_key=api_key, base_url=self.base_url, max_retries=0)
             if not self.model:
                 self.model = "claude-sonnet-4-5-20250929"
         
@@ -62,72 +884,608 @@ class AIProcessor:
             if not api_key:
                 raise RuntimeError("OPENAI_API_KEY environment variable not set")
             
-            self.client = openai.OpenAI(api_key=api_key)
+            self.client = openai.OpenAI(api_key=api_key, base_url=self.base_url, max_retries=0)
             if not self.model:
                 self.model = "gpt-4-turbo-preview"
         
         else:
             raise ValueError(f"Unsupported AI provider: {self.provider}")
     
-    def call_ai(self, prompt: str, system_prompt: Optional[str] = None) -> str:
-        """Make AI API call and return response."""
-        try:
+    def _record(self, **counts: int):
+        """Add counts to the current section's call statistics, if any."""
+        stats = _call_stats.get()
+        if stats is not None:
+            stats.add(**counts)
+    
+    def call_ai(self, prompt: str, system_prompt: Optional[str] = None,
+                source: Optional[str] = None, stream_to: Optional[Path] = None,
+                output_schema: Optional[Dict[str, Any]] = None,
+                validator: Optional[Callable[[], "JSONStreamValidator"]] = None,
+                use_cache: bool = True) -> str:
+        """Make AI API call and return response.
+        
+        source is an optional large, stable block sent ahead of prompt in the
+        user message. Requests with the same system prompt and source share a
+        prefix the provider can cache (see _build_request).
+        
+        With a ResponseCache attached, identical requests (same provider, model,
+        prompts, max_tokens and temperature) are answered from disk, unless
+        use_cache is False (connection tests must reach the provider).
+        
+        In streaming mode, stream_to names a file that receives the response as
+        it arrives (see _stream_provider).
+        
+        A response cut off at max_tokens is continued with up to
+        max_continuations follow-up requests (see _continue) and returned whole.
+        
+        With output_schema (a JSON schema), the response is requested as
+        structured output and returned as JSON text (see _build_request).
+        
+        In streaming mode, validator makes a fresh JSONStreamValidator for each
+        attempt: a response that turns out malformed is aborted as soon as that
+        is certain and retried at once; after JSON_MAX_ABORTS aborts the
+        response is received whole, for the caller to repair (see _send).
+        """
+        self._record(calls=1)
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache_key(prompt, system_prompt, source, output_schema)
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                self._record(cache_hits=1)
+                print(f"  Cache hit: {cache_key[:12]}", file=sys.stderr)
+                return entry["text"]
+            self._record(cache_misses=1)
+        
+        self._record(api_calls=1)
+        request = self._build_request(prompt, system_prompt, source, output_schema)
+        
+        text, stop_reason = self._send(request, self._estimate_cost(prompt, system_prompt, source),
+                                       stream_to, validator)
+        
+        if stop_reason in TRUNCATED_STOP_REASONS and output_schema is None:
+            # (structured output can't be continued: the schema makes every
+            # request start a new object)
+            text, stop_reason = self._continue(request, text, prompt, system_prompt, source)
+            if stream_to is not None and self.stream:
+                stream_to.write_text(text, encoding="utf-8")
+        
+        if stop_reason in TRUNCATED_STOP_REASONS:
+            # Not cached: a later run (perhaps with a larger max_tokens) should retry it
+            self._record(truncated_responses=1)
+            print(f"  WARNING: Response stopped at max_tokens ({self.max_tokens})", file=sys.stderr)
+        elif cache_key is not None:
+            self.cache_response(cache_key, text)
+        
+        return text
+    
+    def _continue(self, request: Dict[str, Any], text: str, prompt: str,
+                  system_prompt: Optional[str], source: Optional[str]) -> Tuple[str, Optional[str]]:
+        """Continue a response that stopped at max_tokens; return (whole text, final stop reason).
+        
+        Each follow-up request repeats the original one with the output so far
+        as an assistant turn: Anthropic continues a trailing assistant message
+        in place (prefill); OpenAI is asked to continue (CONTINUE_PROMPT). Stops
+        when a response completes, after max_continuations requests, or when the
+        context window has no room left for more output.
+        """
+        stop_reason = TRUNCATED_STOP_REASONS[0]
+        continuations = 0
+        input_tokens = self.estimate_request_tokens(prompt, system_prompt, source)
+        while stop_reason in TRUNCATED_STOP_REASONS and continuations < self.max_continuations:
+            room = self.context_window - input_tokens - self.estimate(text) - 64
+            if room < 256:
+                print("  WARNING: No room left in the context window to continue the response",
+                      file=sys.stderr)
+                break
+            
             if self.provider == "anthropic":
-                kwargs = {
-                    "model": self.model,
-                    "max_tokens": self.max_tokens,
-                    "temperature": self.temperature,
-                    "messages": [{"role": "user", "content": prompt}]
-                }
-                if system_prompt:
-                    kwargs["system"] = system_prompt
+                # A prefilled assistant message may not end in whitespace
+                text = text.rstrip()
+                turns = [{"role": "assistant", "content": text}]
+            else:
+                turns = [{"role": "assistant", "content": text},
+                         {"role": "user", "content": CONTINUE_PROMPT}]
+            follow_up = dict(request, messages=request["messages"] + turns,
+                             max_tokens=min(self.max_tokens, room))
+            
+            continuations += 1
+            print(f"  Response stopped at max_tokens after {len(text):,} chars; "
+                  f"continuing ({continuations}/{self.max_continuations})", file=sys.stderr)
+            self._record(api_calls=1)
+            more, stop_reason = self._send(follow_up, self._estimate_cost(prompt, system_prompt,
+                                                                          (source or "") + text))
+            text += more
+        
+        if continuations:
+            self._record(continuations=continuations)
+            if stop_reason not in TRUNCATED_STOP_REASONS:
+                print(f"  Response completed after {continuations} continuation(s): {len(text):,} chars",
+                      file=sys.stderr)
+        return text, stop_reason
+    
+    def _send(self, request: Dict[str, Any], estimate: Dict[str, float],
+              stream_to: Optional[Path] = None,
+              validator: Optional[Callable[[], "JSONStreamValidator"]] = None) -> Tuple[str, Optional[str]]:
+        """Send a request, pacing it through the rate limiter and retrying transient errors.
+        
+        Retryable errors (see classify_error) are retried up to max_retries times
+        with capped exponential backoff and full jitter, or after the provider's
+        retry-after when it sends one (capped the same way). A stream aborted as malformed (validator)
+        is retried without delay; after JSON_MAX_ABORTS such aborts the stream
+        is no longer validated, so the caller's repair stage gets a whole
+        response. Fatal errors fail immediately. Retries are counted in the
+        section's ai_stats, per reason.
+        
+        A failed request's token estimate goes back to the rate limiter, except
+        for what an aborted stream has used: its input and the output so far.
+        
+        Returns (response text, stop reason).
+        """
+        attempt = 0
+        aborts = 0
+        while True:
+            attempt += 1
+            if self.rate_limiter is not None:
+                waited = self.rate_limiter.acquire(estimate)
+                if waited:
+                    self._record(rate_limit_wait_ms=int(waited * 1000))
+            
+            try:
+                if self.stream:
+                    check = validator() if validator and aborts < JSON_MAX_ABORTS else None
+                    text, stop_reason, usage = self._stream_provider(request, stream_to, check)
+                else:
+                    text, stop_reason, usage = self._call_provider(request)
+            
+            except Exception as e:
+                headers = getattr(getattr(e, "response", None), "headers", None)
+                self._observe_headers(headers)
+                retryable, reason = classify_error(e)
+                if self.rate_limiter is not None:
+                    if reason == "malformed_json":
+                        # The provider took (and bills) the input and the output so far:
+                        # refund only the output that was never generated
+                        unused = estimate["output_tokens"] - self.estimate(getattr(e, "received", ""))
+                        self.rate_limiter.settle({"output_tokens": -max(0.0, unused)})
+                    else:
+                        # Refund the tokens: a failed request is (mostly) not billed
+                        self.rate_limiter.settle({
+                            "input_tokens": -estimate["input_tokens"],
+                            "output_tokens": -estimate["output_tokens"]
+                        })
                 
-                response = self.client.messages.create(**kwargs)
-                return response.content[0].text
-            
-            elif self.provider == "openai":
-                messages = []
-                if system_prompt:
-                    messages.append({"role": "system", "content": system_prompt})
-                messages.append({"role": "user", "content": prompt})
+                if not retryable or attempt > self.max_retries:
+                    if attempt > 1:
+                        print(f"  Giving up after {attempt} attempts", file=sys.stderr)
+                    raise RuntimeError(f"AI API call failed ({reason}): {e}") from e
                 
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    max_tokens=self.max_tokens,
-                    temperature=self.temperature
+                retry_after = parse_retry_after(headers)
+                backoff = random.uniform(0, min(self.retry_cap, self.retry_base * 2 ** (attempt - 1)))
+                if retry_after is not None:
+                    delay = min(self.retry_cap, retry_after) + random.uniform(0, 1)
+                else:
+                    delay = backoff
+                if reason == "malformed_json":
+                    delay = 0.0  # Nothing to wait for: the provider is fine, the output wasn't
+                    aborts += 1
+                    if aborts >= JSON_MAX_ABORTS:
+                        print("  Receiving the next response whole: its JSON is repaired afterwards",
+                              file=sys.stderr)
+                self._record(retries=1, **{f"retries_{reason}": 1})
+                print(f"  Retryable error ({reason}): {e}", file=sys.stderr)
+                print(f"  Retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries + 1})",
+                      file=sys.stderr)
+                time.sleep(delay)
+                continue
+            
+            if usage:
+                self._calibrate(estimate["input_tokens"], usage)
+            
+            if self.rate_limiter is not None and usage:
+                actual_input = usage.get("input_tokens", 0) + usage.get("cache_write_tokens", 0)
+                self.rate_limiter.settle({
+                    "input_tokens": actual_input - estimate["input_tokens"],
+                    "output_tokens": usage.get("output_tokens", 0) - estimate["output_tokens"]
+                })
+                self._output_estimate = 0.8 * self._output_estimate + 0.2 * usage.get("output_tokens", 0)
+            
+            return text, stop_reason
+    
+    def _estimate_cost(self, prompt: str, system_prompt: Optional[str],
+                       source: Optional[str]) -> Dict[str, float]:
+        """Rough rate-limiter cost of a request before it is sent (settled afterwards)."""
+        return {
+            "requests": 1,
+            "input_tokens": float(self.estimate_request_tokens(prompt, system_prompt, source)),
+            "output_tokens": min(float(self.max_tokens), self._output_estimate)
+        }
+    
+    def estimate(self, text: str) -> int:
+        """Estimated tokens in text, corrected by what responses have reported so far."""
+        return int(estimate_tokens(text) * self._token_ratio)
+    
+    def estimate_request_tokens(self, prompt: str, system_prompt: Optional[str] = None,
+                                source: Optional[str] = None) -> int:
+        """Estimated input tokens of a whole request (plus a little message framing)."""
+        return self.estimate(prompt) + self.estimate(system_prompt or "") + self.estimate(source or "") + 16
+    
+    def _calibrate(self, estimated: float, usage: Dict[str, int]):
+        """Record estimated vs. actual input tokens and nudge the estimate correction."""
+        actual = usage.get("input_tokens", 0) + usage.get("cache_write_tokens", 0)
+        if self.provider == "anthropic":
+            actual += usage.get("cache_read_tokens", 0)  # (OpenAI's prompt_tokens include them)
+        self._record(estimated_input_tokens=int(estimated))
+        if estimated > 0 and actual > 0:
+            ratio = self._token_ratio * (actual / estimated) ** 0.2
+            self._token_ratio = min(4.0, max(0.25, ratio))
+    
+    def input_budget(self) -> int:
+        """Input tokens one request may use: context_fraction of the context
+        window, leaving room for max_tokens of output."""
+        budget = min(int(self.context_window * self.context_fraction),
+                     self.context_window - self.max_tokens)
+        return max(budget, self.context_window // 4)
+    
+    def source_budget(self, section_info: Dict[str, Any]) -> int:
+        """Tokens available for the source text once the largest prompt around it is counted."""
+        overhead = max(self.estimate_request_tokens(*self.build_prompt(kind, "", section_info))
+                       for kind in ("summary", "index", "combined", "chunk"))
+        return self.input_budget() - overhead
+    
+    def count_source_tokens(self, text: str, section_info: Dict[str, Any]) -> int:
+        """Input tokens of a source block: exact with count_tokens set, else estimated.
+        
+        Anthropic counts through its count-tokens endpoint; OpenAI has none, so
+        the local tokenizer is used (tiktoken when installed).
+        """
+        source = self._source_block(text, section_info)
+        if self.count_tokens and self.provider == "anthropic":
+            try:
+                response = self.client.messages.count_tokens(
+                    model=self.model, messages=[{"role": "user", "content": source}])
+                self._record(count_token_calls=1)
+                return response.input_tokens
+            except Exception as e:
+                print(f"  WARNING: Token count request failed, using estimate: {e}", file=sys.stderr)
+        return self.estimate(source)
+    
+    def _observe_headers(self, headers: Any):
+        """Feed provider rate-limit headers to the rate limiter."""
+        if self.rate_limiter is not None:
+            self.rate_limiter.update_from_headers(headers)
+    
+    def cache_key(self, prompt: str, system_prompt: Optional[str] = None,
+                  source: Optional[str] = None, output_schema: Optional[Dict[str, Any]] = None) -> str:
+        """Response cache key for a request."""
+        fields = {}
+        if output_schema is not None:
+            fields["output_schema"] = output_schema  # (absent otherwise, so older keys stay valid)
+        return ResponseCache.make_key(
+            provider=self.provider, model=self.model, system_prompt=system_prompt,
+            source=source, prompt=prompt, max_tokens=self.max_tokens,
+            temperature=self.temperature, **fields
+        )
+    
+    def cache_response(self, cache_key: str, text: str):
+        """Store a completed response in the response cache."""
+        self.cache.put(cache_key, {
+            "provider": self.provider,
+            "model": self.model,
+            "created": datetime.now().isoformat(),
+            "text": text
+        })
+    
+    def _build_request(self, prompt: str, system_prompt: Optional[str] = None,
+                       source: Optional[str] = None,
+                       output_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Build provider request parameters for one completion.
+        
+        Anthropic: source becomes its own content block; with prompt_cache set it
+        carries a cache_control breakpoint, caching system prompt + source.
+        OpenAI: source is prepended to the user message; prefixes are cached
+        automatically (>= 1024 tokens), no markup needed.
+        
+        output_schema requests structured output: Anthropic is made to call the
+        OUTPUT_TOOL tool with the schema as its input schema, OpenAI gets a
+        strict json_schema response_format. Either way the response is JSON
+        that matches the schema (see _message_text).
+        
+        max_tokens is lowered if input plus output would overflow the context window.
+        """
+        input_tokens = self.estimate_request_tokens(prompt, system_prompt, source)
+        max_tokens = max(1, min(self.max_tokens, self.context_window - input_tokens))
+        
+        if self.provider == "anthropic":
+            if source:
+                source_block = {"type": "text", "text": source}
+                if self.prompt_cache:
+                    source_block["cache_control"] = {"type": "ephemeral"}
+                content = [source_block, {"type": "text", "text": prompt}]
+            else:
+                content = prompt
+            
+            kwargs = {
+                "model": self.model,
+                "max_tokens": max_tokens,
+                "temperature": self.temperature,
+                "messages": [{"role": "user", "content": content}]
+            }
+            if system_prompt:
+                kwargs["system"] = system_prompt
+            if output_schema is not None:
+                kwargs["tools"] = [{
+                    "name": OUTPUT_TOOL,
+                    "description": "Record the requested output. Call this exactly once with the complete output.",
+                    "input_schema": output_schema
+                }]
+                kwargs["tool_choice"] = {"type": "tool", "name": OUTPUT_TOOL}
+            return kwargs
+        
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": f"{source}\n\n{prompt}" if source else prompt})
+        
+        kwargs = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": self.temperature
+        }
+        if output_schema is not None:
+            kwargs["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": OUTPUT_TOOL, "strict": True, "schema": output_schema}
+            }
+        return kwargs
+    
+    def _record_usage(self, usage: Any) -> Dict[str, int]:
+        """Record token usage (including prompt cache reads/writes) from a response.
+        
+        usage is an SDK usage object, or a plain dict (OpenAI batch results).
+        Returns the recorded counts.
+        """
+        if usage is None:
+            return {}
+        
+        def field(obj: Any, name: str) -> Any:
+            value = obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+            return value or 0
+        
+        if self.provider == "anthropic":
+            counts = {
+                "input_tokens": field(usage, "input_tokens"),
+                "output_tokens": field(usage, "output_tokens"),
+                "cache_write_tokens": field(usage, "cache_creation_input_tokens"),
+                "cache_read_tokens": field(usage, "cache_read_input_tokens")
+            }
+        else:
+            details = field(usage, "prompt_tokens_details")
+            counts = {
+                "input_tokens": field(usage, "prompt_tokens"),
+                "output_tokens": field(usage, "completion_tokens"),
+                "cache_read_tokens": field(details, "cached_tokens") if details else 0
+            }
+        
+        self._record(**counts)
+        if counts.get("cache_read_tokens") or counts.get("cache_write_tokens"):
+            print(f"  Prompt cache: {counts.get('cache_read_tokens', 0):,} tokens read, "
+                  f"{counts.get('cache_write_tokens', 0):,} written", file=sys.stderr)
+        return counts
+    
+    @staticmethod
+    def _message_text(message: Any) -> str:
+        """Text of an Anthropic message; the input of an OUTPUT_TOOL call, as JSON."""
+        for block in message.content:
+            if getattr(block, "type", None) == "tool_use" and block.name == OUTPUT_TOOL:
+                return json.dumps(block.input, ensure_ascii=False)
+        return "".join(block.text for block in message.content if getattr(block, "type", None) == "text")
+    
+    def _call_provider(self, request: Dict[str, Any]) -> Tuple[str, Optional[str], Dict[str, int]]:
+        """Send one request to the provider; return (response text, stop reason, usage).
+        
+        Errors propagate unwrapped so _send can classify them.
+        """
+        if self.provider == "anthropic":
+            raw = self.client.messages.with_raw_response.create(**request)
+            self._observe_headers(raw.headers)
+            response = raw.parse()
+            usage = self._record_usage(getattr(response, "usage", None))
+            return self._message_text(response), response.stop_reason, usage
+        
+        elif self.provider == "openai":
+            raw = self.client.chat.completions.with_raw_response.create(**request)
+            self._observe_headers(raw.headers)
+            response = raw.parse()
+            usage = self._record_usage(getattr(response, "usage", None))
+            return response.choices[0].message.content, response.choices[0].finish_reason, usage
+        
+        raise ValueError(f"Unsupported AI provider: {self.provider}")
+    
+    def _stream_provider(self, request: Dict[str, Any], stream_to: Optional[Path] = None,
+                         validator: Optional["JSONStreamValidator"] = None
+                         ) -> Tuple[str, Optional[str], Dict[str, int]]:
+        """Stream one response from the provider; return (response text, stop reason, usage).
+        
+        Text is written to <stream_to>.partial as it arrives and the file is
+        renamed to stream_to once the response is complete (a failed response
+        leaves the .partial file behind for inspection). Progress and the final
+        tokens/sec rate go to stderr; usage and stop reason come from the end of
+        the stream. Streaming also avoids client-side timeouts on long
+        generations. Errors propagate unwrapped (see _send).
+        
+        With a validator, every delta is checked as it arrives; a
+        MalformedResponseError closes the stream, so no more output is paid for.
+        """
+        label = stream_to.name if stream_to else "response"
+        partial_file = stream_to.with_name(stream_to.name + ".partial") if stream_to else None
+        out = open(partial_file, "w", encoding="utf-8") if partial_file else None
+        
+        chunks = []
+        started = time.monotonic()
+        last_report = started
+        
+        def on_text(delta: str):
+            nonlocal last_report
+            chunks.append(delta)
+            if out:
+                out.write(delta)
+                out.flush()
+            if validator:
+                try:
+                    validator.feed(delta)
+                except MalformedResponseError as e:
+                    e.received = "".join(chunks)
+                    raise
+            now = time.monotonic()
+            if now - last_report >= 10:
+                last_report = now
+                received = sum(len(c) for c in chunks)
+                print(f"  Streaming {label}: {received:,} chars, {now - started:.0f}s", file=sys.stderr)
+        
+        try:
+            if self.provider == "anthropic":
+                with self.client.messages.stream(**request) as stream:
+                    self._observe_headers(stream.response.headers)
+                    for delta in stream.text_stream:
+                        on_text(delta)
+                    message = stream.get_final_message()
+                text = self._message_text(message)  # (structured output arrives as tool input, not text)
+                usage = message.usage
+                stop_reason = message.stop_reason
+                output_tokens = getattr(usage, "output_tokens", 0)
+            
+            else:
+                usage = None
+                stop_reason = None
+                stream = self.client.chat.completions.create(
+                    **request, stream=True, stream_options={"include_usage": True}
                 )
-                return response.choices[0].message.content
+                self._observe_headers(stream.response.headers)
+                with stream:  # (closes the connection if on_text aborts the stream)
+                    for chunk in stream:
+                        if getattr(chunk, "usage", None):
+                            usage = chunk.usage
+                        if chunk.choices:
+                            choice = chunk.choices[0]
+                            if choice.delta and choice.delta.content:
+                                on_text(choice.delta.content)
+                            if choice.finish_reason:
+                                stop_reason = choice.finish_reason
+                output_tokens = getattr(usage, "completion_tokens", 0) if usage else 0
+                text = "".join(chunks)
+        
+        finally:
+            if out:
+                out.close()
+        
+        if partial_file:
+            os.replace(partial_file, stream_to)
+        
+        counts = self._record_usage(usage)
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(f"  Streamed {label}: {output_tokens:,} tokens in {elapsed:.1f}s "
+              f"({output_tokens / elapsed:.1f} tokens/s), stop reason: {stop_reason}", file=sys.stderr)
+        
+        return text, stop_reason, counts
+    
+    def submit_batch(self, requests: Dict[str, Dict[str, Any]], work_dir: Path) -> Dict[str, Any]:
+        """Submit requests (custom_id -> _build_request params) to the provider batch API.
+        
+        Returns the provider batch details to persist in the job manifest.
+        """
+        try:
+            if self.provider == "anthropic":
+                batch = self.client.messages.batches.create(requests=[
+                    {"custom_id": custom_id, "params": params}
+                    for custom_id, params in requests.items()
+                ])
+                return {"batch_id": batch.id}
+            
+            # OpenAI takes the requests as an uploaded JSONL file
+            input_path = work_dir / f"batch-input-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl"
+            with open(input_path, "w", encoding="utf-8") as f:
+                for custom_id, params in requests.items():
+                    f.write(json.dumps({
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": params
+                    }) + "\n")
+            with open(input_path, "rb") as f:
+                input_file = self.client.files.create(file=f, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            return {"batch_id": batch.id, "input_file_id": input_file.id}
         
         except Exception as e:
-            raise RuntimeError(f"AI API call failed: {e}")
+            raise RuntimeError(f"Batch submission failed: {e}")
     
-    def generate_summary(self, text: str, section_info: Dict[str, Any]) -> str:
-        """Generate structured summary with Mermaid diagrams."""
-        system_prompt = """You are a technical documentation expert. Your task is to create a comprehensive, structured summary optimized for LLM consumption.
-
-Focus on:
-- Key concepts, workflows, and features
-- Glossary terms with precise definitions
-- Version-specific behaviors and caveats
-- Common pitfalls and troubleshooting
-- Hierarchical topic organization
-- Mermaid diagrams for visual concepts (workflows, hierarchies, state machines)
-
-Output format: Clean Markdown with semantic structure. Use headers, lists, tables, and code blocks appropriately."""
-
-        section_name = section_info.get("name", "unknown")
-        section_title = section_info.get("title", "Documentation Section")
-        doc_version = section_info.get("doc_version", "unknown")
-        description = section_info.get("description", "")
+    def batch_status(self, batch_id: str) -> Tuple[bool, str]:
+        """Return (finished, human-readable status) for a submitted batch."""
+        if self.provider == "anthropic":
+            batch = self.client.messages.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            return batch.processing_status == "ended", (
+                f"{batch.processing_status}: {counts.succeeded} succeeded, "
+                f"{counts.processing} processing, {counts.errored} errored"
+            )
+        
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        finished = batch.status in ("completed", "failed", "expired", "cancelled")
+        return finished, f"{batch.status}: {counts.completed}/{counts.total} completed, {counts.failed} failed"
+    
+    def batch_results(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        """Fetch results of a finished batch.
         
-        prompt = f"""# Documentation Summary Task
+        Returns custom_id -> {"text": ..., "usage": ..., "stop_reason": ...} or {"error": ...}.
+        """
+        results = {}
+        
+        if self.provider == "anthropic":
+            for entry in self.client.messages.batches.results(batch_id):
+                if entry.result.type == "succeeded":
+                    message = entry.result.message
+                    results[entry.custom_id] = {"text": self._message_text(message), "usage": message.usage,
+                                                "stop_reason": message.stop_reason}
+                else:
+                    error = getattr(entry.result, "error", None)
+                    results[entry.custom_id] = {"error": f"{entry.result.type}: {error}"}
+            return results
+        
+        batch = self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                body = response.get("body") or {}
+                if response.get("status_code") == 200 and body.get("choices"):
+                    results[record["custom_id"]] = {
+                        "text": body["choices"][0]["message"]["content"],
+                        "usage": body.get("usage"),
+                        "stop_reason": body["choices"][0].get("finish_reason")
+                    }
+                else:
+                    error = record.get("error") or body.get("error") or f"HTTP {response.get('status_code')}"
+                    results[record["custom_id"]] = {"error": str(error)}
+        return results
+    
+    def _summary_task(self) -> str:
+        """Summary instructions (follows the source block)."""
+        return f"""# Documentation Summary Task
 
-**Section:** {section_title} ({section_name})
-**Document Version:** {doc_version}
-**Description:** {description}
+{SUMMARY_GUIDELINES}
 
-Process the following documentation excerpt and create a comprehensive structured summary.
+Process the documentation excerpt above and create a comprehensive structured summary.
 
 ## Requirements
 
@@ -144,58 +1502,18 @@ Process the following documentation excerpt and create a comprehensive structure
 - Use flowcharts for workflows
 - Use graph diagrams for hierarchies/relationships
 - Use sequence diagrams for interactions
-- Embed directly in Markdown with ```mermaid code blocks
-
-## Source Text
-
-{text[:50000]}  
-
-{"... [text truncated for length] ..." if len(text) > 50000 else ""}
-
-Generate the structured summary now."""
-
-        response = self.call_ai(prompt, system_prompt)
-        
-        # Sanity check for truncated/failed responses
-        if len(response) < 100:
-            section_name = section_info.get("name", "unknown")
-            output_dir = Path(os.getenv("OUTPUT_DIR", "."))
-            forensics_file = output_dir / f"FAILED-summary-response-{section_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
-            try:
-                with open(forensics_file, "w", encoding="utf-8") as f:
-                    f.write("=== AI Response (Suspiciously Short Summary) ===\n")
-                    f.write(f"Section: {section_info.get('title', 'Unknown')}\n")
-                    f.write(f"Timestamp: {datetime.now().isoformat()}\n")
-                    f.write(f"Response length: {len(response)} chars (expected thousands)\n")
-                    f.write("\n=== Full Response ===\n")
-                    f.write(response)
-                print(f"DEBUG: Suspiciously short summary saved to: {forensics_file}", file=sys.stderr)
-            except Exception as write_err:
-                print(f"DEBUG: Failed to save forensics file: {write_err}", file=sys.stderr)
-        
-        return response
+- Embed directly in Markdown with ```mermaid code blocks"""
     
-    def generate_index(self, text: str, section_info: Dict[str, Any]) -> Dict[str, Any]:
-        """Generate LLM-optimized index as JSON."""
-        system_prompt = """You are creating a searchable index for LLM-based documentation retrieval. 
-
-Output must be valid JSON with:
-- concepts: list of key concepts with descriptions
-- terms: technical terms with context
-- topics: hierarchical topic clusters
-- patterns: user intent patterns (how-to, what-is, troubleshooting)
-- cross_refs: related concepts mentioned
-
-Be precise and comprehensive."""
-
+    def _index_task(self, section_info: Dict[str, Any]) -> str:
+        """Index instructions and required JSON structure (follows the source block)."""
         section_name = section_info.get("name", "unknown")
         section_title = section_info.get("title", "Documentation Section")
         
-        prompt = f"""# Index Generation Task
+        return f"""# Index Generation Task
 
-**Section:** {section_title} ({section_name})
+{INDEX_GUIDELINES}
 
-Create a comprehensive searchable index from the documentation text below.
+Create a comprehensive searchable index from the documentation text above.
 
 ## Required JSON Structure
 
@@ -219,17 +1537,62 @@ Create a comprehensive searchable index from the documentation text below.
   "cross_refs": [
     {{"from": "concept_a", "to": "concept_b", "relationship": "uses|requires|relates"}}
   ]
-}}
-
-## Source Text
-
-{text[:50000]}
+}}"""
+    
+    def _source_block(self, text: str, section_info: Dict[str, Any]) -> str:
+        """Section header and source text: the prefix shared by all requests for a section."""
+        section_name = section_info.get("name", "unknown")
+        section_title = section_info.get("title", "Documentation Section")
+        doc_version = section_info.get("doc_version", "unknown")
+        description = section_info.get("description", "")
+        # Chunk requests (see condense) say which part of the section they carry
+        part = f"\n**Part:** {section_info['part']}" if section_info.get("part") else ""
+        
+        return f"""# Source Documentation
 
-{"... [text truncated for length] ..." if len(text) > 50000 else ""}
+**Section:** {section_title} ({section_name})
+**Document Version:** {doc_version}
+**Description:** {description}{part}
 
-Generate the index as valid JSON now. Output ONLY the JSON, no additional text."""
+## Source Text
 
-        response = self.call_ai(prompt, system_prompt)
+{text}"""
+    
+    def _save_forensics(self, kind: str, heading: str, response: str,
+                        section_info: Dict[str, Any], details: List[str]) -> None:
+        """Save a suspicious AI response to OUTPUT_DIR for later inspection."""
+        section_name = section_info.get("name", "unknown")
+        output_dir = Path(os.getenv("OUTPUT_DIR", "."))
+        forensics_file = output_dir / f"FAILED-{kind}-response-{section_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+        try:
+            with open(forensics_file, "w", encoding="utf-8") as f:
+                f.write(f"=== AI Response ({heading}) ===\n")
+                f.write(f"Section: {section_info.get('title', 'Unknown')}\n")
+                f.write(f"Timestamp: {datetime.now().isoformat()}\n")
+                for line in details:
+                    f.write(f"{line}\n")
+                f.write("\n=== Full Response ===\n")
+                f.write(response)
+            print(f"DEBUG: {heading} response saved to: {forensics_file}", file=sys.stderr)
+        except Exception as write_err:
+            print(f"DEBUG: Failed to save forensics file: {write_err}", file=sys.stderr)
+    
+    def check_summary(self, response: str, section_info: Dict[str, Any]) -> str:
+        """Sanity check a summary response; keep forensics if suspiciously short."""
+        if len(response) < 100:
+            self._save_forensics("summary", "Suspiciously Short Summary", response, section_info,
+                                 [f"Response length: {len(response)} chars (expected thousands)"])
+        return response
+    
+    def parse_index(self, response: str, section_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Extract the index JSON object from an AI response."""
+        # Structured output (and any other bare JSON response) parses as is
+        try:
+            index = json.loads(response)
+            if isinstance(index, dict):
+                return index
+        except ValueError:
+            pass
         
         # Extract JSON from response (handle markdown code blocks)
         json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', response, re.DOTALL)
@@ -248,22 +1611,20 @@ Generate the index as valid JSON now. Output ONLY the JSON, no additional text."
                 except:
                     pass
             
+            # Repair: locally if possible, else by the model, one excerpt at a time
+            broken = response[json_start:] if json_start >= 0 else response
+            index = repair_json(broken)
+            if isinstance(index, dict):
+                self._record(json_local_repairs=1)
+                print(f"  Repaired index JSON locally ({e})", file=sys.stderr)
+                return index
+            index = self.repair_json_with_model(broken)
+            if isinstance(index, dict):
+                return index
+            
             # Save full response for forensics
-            section_name = section_info.get("name", "unknown")
-            output_dir = Path(os.getenv("OUTPUT_DIR", "."))
-            forensics_file = output_dir / f"FAILED-index-response-{section_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
-            try:
-                with open(forensics_file, "w", encoding="utf-8") as f:
-                    f.write("=== AI Response (Failed JSON Parse) ===\n")
-                    f.write(f"Section: {section_info.get('title', 'Unknown')}\n")
-                    f.write(f"Timestamp: {datetime.now().isoformat()}\n")
-                    f.write(f"Response length: {len(response)} chars\n")
-                    f.write(f"Parse error: {e}\n")
-                    f.write("\n=== Full Response ===\n")
-                    f.write(response)
-                print(f"DEBUG: Full response saved to: {forensics_file}", file=sys.stderr)
-            except Exception as write_err:
-                print(f"DEBUG: Failed to save forensics file: {write_err}", file=sys.stderr)
+            self._save_forensics("index", "Failed JSON Parse", response, section_info,
+                                 [f"Response length: {len(response)} chars", f"Parse error: {e}"])
             
             # Debug output for troubleshooting
             print(f"DEBUG: Failed to parse JSON from AI response", file=sys.stderr)
@@ -272,6 +1633,409 @@ Generate the index as valid JSON now. Output ONLY the JSON, no additional text."
             print(f"DEBUG: Last 500 chars: {response[-500:]}", file=sys.stderr)
             
             raise RuntimeError(f"Failed to parse AI-generated JSON: {e}")
+    
+    def repair_json_with_model(self, text: str) -> Optional[Any]:
+        """Fix JSON that repair_json can't by asking the model to correct only
+        the excerpt around each parse error (not the whole response, let alone
+        the original request). Up to json_repair_rounds requests; returns the
+        parsed JSON, or None.
+        """
+        for attempt in range(1, self.json_repair_rounds + 1):
+            try:
+                return json.loads(text)
+            except json.JSONDecodeError as e:
+                error = e
+            
+            # The excerpt: whole lines around the error (pretty-printed JSON), or
+            # a fixed number of characters on either side
+            start = max(0, error.pos - JSON_REPAIR_CONTEXT)
+            end = min(len(text), error.pos + JSON_REPAIR_CONTEXT)
+            line_start = text.rfind("\n", 0, start) + 1
+            line_end = text.find("\n", end)
+            if line_start > 0 and error.pos - line_start <= 2 * JSON_REPAIR_CONTEXT:
+                start = line_start
+            if 0 <= line_end and line_end - error.pos <= 2 * JSON_REPAIR_CONTEXT:
+                end = line_end
+            excerpt = text[start:end]
+            
+            print(f"  Asking the model to repair index JSON ({error.msg} at char {error.pos}; "
+                  f"{len(excerpt):,} char excerpt, round {attempt}/{self.json_repair_rounds})",
+                  file=sys.stderr)
+            self._record(json_model_repairs=1)
+            prompt = f"""The excerpt below was cut from the middle of a large JSON document. Parsing the document fails inside it: {error.msg} (at character {error.pos - start + 1} of the excerpt).
+
+Return the excerpt with the syntax error corrected and nothing else changed: same content, same start and end (even if they fall mid-value), no code fences, no explanation.
+
+Excerpt:
+{excerpt}"""
+            try:
+                fixed = self.call_ai(prompt, JSON_REPAIR_SYSTEM_PROMPT)
+            except Exception as e:
+                print(f"  WARNING: JSON repair request failed: {e}", file=sys.stderr)
+                return None
+            fence = re.fullmatch(r"\s*```(?:json)?\n(.*?)\n?```\s*", fixed, re.DOTALL)
+            if fence:
+                fixed = fence.group(1)
+            text = text[:start] + fixed + text[end:]
+            
+            repaired = repair_json(text)  # (also covers a truncated tail behind the fix)
+            if repaired is not None:
+                return repaired
+        return None
+    
+    def build_prompt(self, kind: str, text: str, section_info: Dict[str, Any]) -> Tuple[str, str, str]:
+        """Build (prompt, system_prompt, source) for a "summary", "index", "combined" or "chunk" request."""
+        if kind == "summary":
+            prompt = f"""{self._summary_task()}
+
+Generate the structured summary now."""
+        
+        elif kind == "index" and self.structured_index:
+            prompt = f"""{self._index_task(section_info)}
+
+Generate the index now, in the required structure."""
+        
+        elif kind == "index":
+            prompt = f"""{self._index_task(section_info)}
+
+Generate the index as valid JSON now. Output ONLY the JSON, no additional text."""
+        
+        elif kind == "chunk":
+            prompt = f"""# Partial Notes Task
+
+{CHUNK_GUIDELINES}
+
+Generate the notes for this part now."""
+        
+        elif kind == "combined" and self.structured_index:
+            prompt = f"""{self._summary_task()}
+
+{self._index_task(section_info)}
+
+## Output Format
+
+Produce BOTH outputs from the source text above in one object: "summary" holds the
+structured Markdown summary, "index" the index in the required structure.
+
+Generate both outputs now."""
+        
+        elif kind == "combined":
+            prompt = f"""{self._summary_task()}
+
+{self._index_task(section_info)}
+
+## Output Format
+
+Produce BOTH outputs from the source text above, in this exact order, each introduced
+by its marker line exactly as shown:
+
+{SUMMARY_MARKER}
+(the structured Markdown summary)
+{INDEX_MARKER}
+(the index as valid JSON only, no additional text)
+
+Generate both outputs now."""
+        
+        else:
+            raise ValueError(f"Unknown request kind: {kind}")
+        
+        return prompt, DOCUMENT_SYSTEM_PROMPT, self._source_block(text, section_info)
+    
+    def index_validator(self, marker: Optional[str] = None) -> Optional[Callable[[], JSONStreamValidator]]:
+        """Streamed index validation (JSON after marker, if given); None when
+        not streaming or when structured output guarantees valid JSON anyway."""
+        if not self.stream or self.structured_index:
+            return None
+        return lambda: JSONStreamValidator(JSON_MAX_PREAMBLE, marker)
+    
+    def output_schema(self, kind: str) -> Optional[Dict[str, Any]]:
+        """Structured output schema for a request kind (None: free-form text)."""
+        if not self.structured_index:
+            return None
+        return {"index": INDEX_SCHEMA, "combined": COMBINED_SCHEMA}.get(kind)
+    
+    def condense(self, text: str, section_info: Dict[str, Any], raw_text: Optional[str] = None) -> str:
+        """Map step for text too long for one request.
+        
+        Returns text unchanged if it fits the source token budget (see
+        source_budget). Otherwise the text is split at page boundaries
+        (pdftotext form feeds) into chunks of up to chunk_tokens, notes are
+        taken on every chunk in parallel, and the notes (in page order) are
+        returned to stand in for the text in the summary/index requests, which
+        become the reduce step. Notes that are still too long are condensed
+        again the same way.
+        
+        With a chunk plan (see plan_parts), chunks are packed from its
+        heading-aligned segments, so they end on headings.
+        
+        With a page cache and a known start_page, notes are taken on cached
+        page blocks instead (see page_block_notes), so any page range costs
+        only its uncached blocks plus the reduce step. The blocks are cut from
+        raw_text, the text as extracted (text itself if not given).
+        """
+        tag = f"[{section_info['name']}]"
+        budget = self.source_budget(section_info)
+        chunk_budget = min(self.chunk_tokens, budget) if self.chunk_tokens else budget
+        
+        # Number pages as in the document when the section's first page is known
+        start_page = int(section_info.get("start_page") or 1)
+        parts = [(n, n, page) for n, page in enumerate(text.split("\f"), start_page) if page.strip()]
+        
+        tokens = self.count_source_tokens(text, section_info)
+        print(f"  {tag} Source: ~{tokens:,} tokens (budget {budget:,} of {self.context_window:,} "
+              f"context)", file=sys.stderr)
+        if tokens <= budget:
+            return text
+        print(f"  {tag} ~{tokens:,} tokens exceed one request: taking notes on parts...",
+              file=sys.stderr)
+        
+        if self.reads_page_blocks(section_info):
+            pages = [(n, n, page) for n, page in enumerate((raw_text or text).split("\f"), start_page)
+                     if page.strip()]
+            parts = self.page_block_notes(pages, section_info, chunk_budget)
+        else:
+            parts = self.take_notes(self.plan_parts(parts, chunk_budget, section_info),
+                                    chunk_budget, "\f", section_info)
+        
+        notes = "\n\n".join(part for _, _, part in parts)
+        tokens = self.estimate(notes)
+        while tokens > budget and len(parts) > 1:
+            print(f"  {tag} Notes (~{tokens:,} tokens) exceed one request: condensing again...",
+                  file=sys.stderr)
+            parts = self.take_notes(parts, chunk_budget, "\n\n", section_info)
+            notes = "\n\n".join(part for _, _, part in parts)
+            tokens = self.estimate(notes)
+        
+        return (f"(Condensed notes: the full section text ({len(text):,} chars, pages "
+                f"{parts[0][0]}-{parts[-1][1]}) was read in parts. The notes below cover every "
+                f"page, in page order.)\n\n{notes}\n")
+    
+    def plan_parts(self, pages: List[Tuple[int, int, str]], chunk_budget: int,
+                   section_info: Dict[str, Any]) -> List[Tuple[int, int, str]]:
+        """Group (page, page, text) parts into the segments of the section's chunk plan.
+        
+        The plan (section_info["chunk_plan"], written by chunk-planner.py) lists
+        heading-aligned page ranges. Segments too big for one chunk stay split
+        into pages; pages the plan doesn't cover are kept as they are. Without
+        a plan the pages are returned unchanged.
+        """
+        plan_file = section_info.get("chunk_plan")
+        if not plan_file:
+            return pages
+        tag = f"[{section_info['name']}]"
+        try:
+            with open(plan_file, "r", encoding="utf-8") as f:
+                segments = json.load(f)["segments"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"  {tag} WARNING: Ignoring unreadable chunk plan {plan_file}: {e}", file=sys.stderr)
+            return pages
+        
+        by_page = {first: text for first, _, text in pages}
+        grouped = []
+        used = set()
+        for segment in segments:
+            members = [(n, n, by_page[n]) for n in range(segment["first_page"], segment["last_page"] + 1)
+                       if n in by_page]
+            if not members:
+                continue
+            joined = "\f".join(text for _, _, text in members)
+            if self.estimate(joined) > chunk_budget:
+                grouped.extend(members)
+            else:
+                grouped.append((members[0][0], members[-1][1], joined))
+            used.update(n for n, _, _ in members)
+        grouped.extend(page for page in pages if page[0] not in used)
+        grouped.sort(key=lambda part: part[0])
+        
+        print(f"  {tag} Chunk plan: {len(segments)} heading-aligned segment(s)", file=sys.stderr)
+        return grouped
+    
+    def take_notes(self, parts: List[Tuple[int, int, str]], chunk_budget: int, separator: str,
+                   section_info: Dict[str, Any]) -> List[Tuple[int, int, str]]:
+        """Pack (first_page, last_page, text) parts into chunks and take notes on each, in parallel.
+        
+        Returns the notes as (first_page, last_page, notes) parts, in page order.
+        """
+        chunks = pack_chunks(parts, chunk_budget, separator, self.estimate)
+        print(f"  [{section_info['name']}] Taking notes on {len(chunks)} chunk(s) in parallel...",
+              file=sys.stderr)
+        
+        def notes_for(i: int, chunk: Tuple[int, int, str]) -> str:
+            first, last, chunk_text = chunk
+            chunk_info = dict(section_info, part=f"{i} of {len(chunks)} (pages {first}-{last})")
+            return self.call_ai(*self.build_prompt("chunk", chunk_text, chunk_info))
+        
+        with ThreadPoolExecutor(max_workers=max(1, self.chunk_concurrency)) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, notes_for, i, chunk)
+                       for i, chunk in enumerate(chunks, 1)]
+        return [(first, last, f"### Pages {first}-{last}\n\n{future.result().strip()}")
+                for (first, last, _), future in zip(chunks, futures)]
+    
+    def reads_page_blocks(self, section_info: Dict[str, Any]) -> bool:
+        """Whether the section is read through cached page-block notes (see page_block_notes)."""
+        return self.page_cache is not None and bool(section_info.get("start_page"))
+    
+    def page_block_notes(self, pages: List[Tuple[int, int, str]], section_info: Dict[str, Any],
+                         chunk_budget: int) -> List[Tuple[int, int, str]]:
+        """Notes for a section's pages, one cached entry per page block.
+        
+        Blocks are page_block document pages long and aligned to document page
+        numbers (pages 1-8, 9-16, ... by default), so overlapping and
+        redefined sections share every block they fully contain; only blocks
+        cut by a section boundary are specific to it. Entries are keyed by
+        the block's text, PAGE_NOTES_VERSION, provider and model, and the
+        requests carry no section details, so the notes don't depend on which
+        section asked for them. For the same reason pages come in as extracted
+        (see condense): keys hash the raw page text, and each block is
+        stripped of running lines and normalized on its own before the request.
+        
+        A block whose prepared text exceeds chunk_budget is split the way
+        pack_chunks splits chunks, and each part is cached on its own.
+        
+        Returns (first_page, last_page, notes) per block, in page order.
+        """
+        tag = f"[{section_info['name']}]"
+        blocks: Dict[int, List[Tuple[int, int, str]]] = {}
+        for page in pages:
+            blocks.setdefault((page[0] - 1) // self.page_block, []).append(page)
+        
+        def prepare(block_text: str) -> str:
+            return normalize_text(strip_running_lines(block_text)[0]) if self.normalize else block_text
+        
+        # (first_page, last_page, raw text) per request, each within chunk_budget
+        units = []
+        for k in sorted(blocks):
+            block_text = "\f".join(page for _, _, page in blocks[k])
+            if self.estimate(prepare(block_text)) > chunk_budget:
+                units.extend(pack_chunks(blocks[k], chunk_budget, "\f", self.estimate))
+            else:
+                units.append((blocks[k][0][0], blocks[k][-1][1], block_text))
+        
+        # Section-independent request header: the document, not the section
+        document_info = {
+            "name": section_info.get("source_name", "document"),
+            "title": section_info.get("source_name", "document"),
+            "doc_version": section_info.get("doc_version", "unknown")
+        }
+        
+        def notes_for(unit: Tuple[int, int, str]) -> Tuple[Tuple[int, int, str], bool]:
+            first, last, block_text = unit
+            key = ResponseCache.make_key(kind="page-notes", version=PAGE_NOTES_VERSION,
+                                         provider=self.provider, model=self.model,
+                                         normalize=self.normalize, text=block_text)
+            entry = self.page_cache.get(key)
+            if entry is not None:
+                self._record(page_cache_hits=1)
+                notes = entry["text"]
+                hit = True
+            else:
+                hit = False
+                self._record(page_cache_misses=1)
+                block_info = dict(document_info, part=f"pages {first}-{last} of the document")
+                notes = self.call_ai(*self.build_prompt("chunk", prepare(block_text), block_info))
+                self.page_cache.put(key, {
+                    "provider": self.provider,
+                    "model": self.model,
+                    "pages": [first, last],
+                    "created": datetime.now().isoformat(),
+                    "text": notes
+                })
+            return (first, last, f"### Pages {first}-{last}\n\n{notes.strip()}"), hit
+        
+        with ThreadPoolExecutor(max_workers=max(1, self.chunk_concurrency)) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, notes_for, unit) for unit in units]
+        results = [future.result() for future in futures]
+        
+        split = len(units) - len(blocks)
+        print(f"  {tag} Page notes: {len(blocks)} block(s) of {self.page_block} pages"
+              f"{f' ({split} more request(s) for blocks over budget)' if split else ''}, "
+              f"{sum(hit for _, hit in results)} of {len(results)} cached", file=sys.stderr)
+        return [part for part, _ in results]
+    
+    def generate_summary(self, text: str, section_info: Dict[str, Any],
+                         stream_to: Optional[Path] = None) -> str:
+        """Generate structured summary with Mermaid diagrams.
+        
+        stream_to: in streaming mode, file to write the summary to as it arrives.
+        """
+        response = self.call_ai(*self.build_prompt("summary", text, section_info), stream_to=stream_to)
+        return self.check_summary(response, section_info)
+    
+    def generate_index(self, text: str, section_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate LLM-optimized index as JSON."""
+        response = self.call_ai(*self.build_prompt("index", text, section_info),
+                                output_schema=self.output_schema("index"),
+                                validator=self.index_validator())
+        return self.parse_index(response, section_info)
+    
+    def generate_combined(self, text: str, section_info: Dict[str, Any]) -> Tuple[str, str]:
+        """Generate summary and index in a single request (source text sent once).
+        
+        Returns (summary, index_response). The index part is returned unparsed so
+        the caller can keep the summary even if the index JSON turns out broken;
+        pass it through parse_index().
+        """
+        response = self.call_ai(*self.build_prompt("combined", text, section_info),
+                                output_schema=self.output_schema("combined"),
+                                validator=self.index_validator(INDEX_MARKER))
+        return self.split_combined(response, section_info)
+    
+    def split_combined(self, response: str, section_info: Dict[str, Any]) -> Tuple[str, str]:
+        """Split a combined response into (summary, unparsed index response)."""
+        if self.structured_index:
+            try:
+                combined = json.loads(response)
+                summary, index = combined["summary"], combined["index"]
+            except (ValueError, TypeError, KeyError) as e:
+                self._save_forensics("combined", "Malformed Structured Output", response, section_info,
+                                     [f"Response length: {len(response)} chars", f"Error: {e}"])
+                raise RuntimeError(f"Combined structured output is malformed: {e}")
+            return self.check_summary(summary.strip() + "\n", section_info), json.dumps(index)
+        
+        summary_start = response.find(SUMMARY_MARKER)
+        index_start = response.find(INDEX_MARKER)
+        if index_start < 0:
+            self._save_forensics("combined", "Missing Index Marker", response, section_info,
+                                 [f"Response length: {len(response)} chars"])
+            raise RuntimeError(f"Combined response has no {INDEX_MARKER} marker")
+        
+        summary_start = summary_start + len(SUMMARY_MARKER) if 0 <= summary_start < index_start else 0
+        summary = self.check_summary(response[summary_start:index_start].strip() + "\n", section_info)
+        return summary, response[index_start + len(INDEX_MARKER):].strip()
+
+
+def pack_chunks(parts: List[Tuple[int, int, str]], max_size: int, separator: str,
+                size: Callable[[str], int] = len) -> List[Tuple[int, int, str]]:
+    """Greedily pack consecutive (first_page, last_page, text) parts into chunks of up to max_size.
+    
+    size measures a text (characters by default, or an estimate_tokens-style
+    counter); chunk sizes are summed from their parts. A single part larger
+    than max_size is cut at line breaks into several chunks.
+    """
+    pieces = []
+    for first, last, part in parts:
+        part_size = size(part)
+        while part_size > max_size:
+            max_chars = max(1, len(part) * max_size // part_size)
+            cut = part.rfind("\n", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            pieces.append((first, last, part[:cut], size(part[:cut]), True))
+            part = part[cut:]
+            part_size = size(part)
+        pieces.append((first, last, part, part_size, False))
+    
+    separator_size = size(separator)
+    chunks = []
+    sizes = []
+    for first, last, piece, piece_size, oversized in pieces:
+        if chunks and not oversized and sizes[-1] + separator_size + piece_size <= max_size:
+            chunks[-1] = (chunks[-1][0], last, chunks[-1][2] + separator + piece)
+            sizes[-1] += separator_size + piece_size
+        else:
+            chunks.append((first, last, piece))
+            sizes.append(piece_size)
+    return chunks
 
 
 def load_metadata(metadata_path: Path) -> Dict[str, Any]:
@@ -300,12 +2064,156 @@ def load_metadata(metadata_path: Path) -> Dict[str, Any]:
         raise RuntimeError(f"Failed to load metadata: {e}")
 
 
-def process_section(text_file: Path, section_info: Dict[str, Any], 
-                    output_dir: Path, ai_processor: AIProcessor) -> Dict[str, Path]:
-    """Process a single section: generate summary and index."""
+# pdftotext -layout noise removed by normalize_text
+_DOT_LEADER = re.compile(r"[ \t]*(?:\.[ \t]?){4,}[ \t]*")
+_COLUMN_GAP = re.compile(r"[ \t]{3,}")
+_PAGE_NUMBER_LINE = re.compile(r"(?:page\s+)?\d{1,4}(?:\s+of\s+\d{1,4})?|[ivxlc]{1,7}", re.IGNORECASE)
+_HYPHEN_BREAK = re.compile(r"([A-Za-z]*[a-z])-\n([a-z][a-z]*)")
+_HEADING_WORD = re.compile(r"[A-Za-z][\w'’-]*")
+_BLANK_RUN = re.compile(r"\n{3,}")
+PAGE_EDGE_LINES = 3  # Lines at the top/bottom of a page checked for page numbers
+
+# Running header/footer detection (see strip_running_lines)
+RUNNING_EDGE_LINES = 4  # Lines at the top/bottom of a page that may be headers/footers
+RUNNING_MIN_PAGES = 3  # A running line repeats on at least this many pages,
+RUNNING_MIN_SHARE = 0.3  # on at least this share of the section's pages,
+RUNNING_MIN_DENSITY = 0.5  # and on at least this share of the pages it spans
+_EDGE_NUMBER = re.compile(r"^(?:page\s+)?\d{1,4}\b|\b\d{1,4}(?:\s+of\s+\d{1,4})?$", re.IGNORECASE)
+
+
+def running_line_key(line: str) -> str:
+    """Compare header/footer candidates ignoring spacing, case and a page number
+    at either end of the line (the only part of a running line that varies)."""
+    return _EDGE_NUMBER.sub("#", " ".join(line.split())).lower()
+
+
+def strip_running_lines(text: str) -> Tuple[str, int]:
+    """Remove running headers and footers from form-feed separated pages.
     
-    print(f"Processing section: {section_info['name']}", file=sys.stderr)
+    Frequency analysis over the first/last RUNNING_EDGE_LINES non-blank lines
+    of every page: a line (see running_line_key) is a running line if it
+    repeats on at least RUNNING_MIN_PAGES pages, on at least
+    RUNNING_MIN_SHARE of the section's pages and on at least
+    RUNNING_MIN_DENSITY of the pages between its first and last occurrence.
+    A line that repeats within a page is taken for body text, not a header.
+    Two linear passes over the text.
+    
+    Returns (text, number of lines removed).
+    """
+    pages = [page.split("\n") for page in text.split("\f")]
+    edges = []
+    seen: Dict[str, List[int]] = {}  # key -> [pages, first page, last page, pages with repeats]
+    content_pages = 0
+    for n, lines in enumerate(pages):
+        content = [i for i, line in enumerate(lines) if line.strip()]
+        content_pages += bool(content)
+        edge = sorted(set(content[:RUNNING_EDGE_LINES] + content[-RUNNING_EDGE_LINES:]))
+        edges.append(edge)
+        keys = [running_line_key(lines[i]) for i in edge]
+        for key in set(keys):
+            entry = seen.get(key)
+            if entry is None:
+                entry = seen[key] = [0, n, n, 0]
+            entry[0] += 1
+            entry[2] = n
+            entry[3] += keys.count(key) > 1
+    
+    min_pages = max(RUNNING_MIN_PAGES, RUNNING_MIN_SHARE * content_pages)
+    running = {key for key, (count, first, last, repeated) in seen.items()
+               if count >= min_pages and count >= RUNNING_MIN_DENSITY * (last - first + 1)
+               and repeated <= count // 10}
+    removed = 0
+    for lines, edge in zip(pages, edges):
+        for i in edge:
+            if running_line_key(lines[i]) in running:
+                lines[i] = ""
+                removed += 1
+    return "\f".join("\n".join(lines) for lines in pages), removed
+
+
+def looks_like_heading(line: str) -> bool:
+    """A short line in title case without closing punctuation ("Color Page")."""
+    words = _HEADING_WORD.findall(line)
+    if not 1 <= len(words) <= 8 or line[-1:] in ".,;!?":
+        return False
+    return words[0][0].isupper() and all(w[0].isupper() for w in words if len(w) > 3)
+
+
+def normalize_text(text: str) -> str:
+    """Remove pdftotext -layout noise that costs input tokens but carries no content.
+    
+    Works page by page; form feeds are kept, so page numbering still works
+    downstream. On every page:
+    - page-number lines among the first/last PAGE_EDGE_LINES lines are dropped
+    - dot leaders ("Node Editor ........ 42") become a single space
+    - indentation and trailing spaces go; column gaps shrink to two spaces
+    - words hyphenated across a line break are rejoined: without the hyphen
+      if the joined word occurs unhyphenated elsewhere in the text, else
+      with it (compounds like "built-in" keep theirs)
+    - wrapped prose lines are joined (never lines with column gaps, and
+      never onto a short title-case line, which is likely a heading)
+    - runs of blank lines collapse to one
+    """
+    words = set(re.findall(r"[a-z]+", text.lower()))
+    
+    def rejoin(match: re.Match) -> str:
+        joined = match.group(1) + match.group(2)
+        return joined if joined.lower() in words else f"{match.group(1)}-{match.group(2)}"
+    
+    pages = []
+    for page in text.split("\f"):
+        lines = [_COLUMN_GAP.sub("  ", _DOT_LEADER.sub(" ", line)).strip() for line in page.split("\n")]
+        
+        content = [i for i, line in enumerate(lines) if line]
+        for i in content[:PAGE_EDGE_LINES] + content[-PAGE_EDGE_LINES:]:
+            if _PAGE_NUMBER_LINE.fullmatch(lines[i]):
+                lines[i] = ""
+        
+        lines = _HYPHEN_BREAK.sub(rejoin, "\n".join(lines)).split("\n")
+        
+        # Reflow: a line continues the previous one if it starts in lower case,
+        # neither looks like a table row and the previous one isn't a heading
+        reflowed = []
+        for line in lines:
+            previous = reflowed[-1] if reflowed else ""
+            if (line[:1].islower() and previous and not previous.endswith(":")
+                    and "  " not in previous and "  " not in line
+                    and not looks_like_heading(previous)):
+                reflowed[-1] = f"{previous} {line}"
+            else:
+                reflowed.append(line)
+        
+        page = _BLANK_RUN.sub("\n\n", "\n".join(reflowed)).strip("\n")
+        pages.append(f"{page}\n" if page else "")
+    return "\f".join(pages)
+
+
+def prepare_text(text: str, section_info: Dict[str, Any], ai_processor: "AIProcessor") -> str:
+    """Strip running headers/footers and normalize section text for the AI
+    (unless disabled), and report the savings.
     
+    Page-block notes don't use the result: their blocks are cut from the text
+    as extracted and prepared one by one (see AIProcessor.page_block_notes).
+    """
+    if not ai_processor.normalize:
+        return text
+    
+    tag = f"[{section_info['name']}]"    
+    normalized, removed = strip_running_lines(text)
+    if removed:
+        print(f"  {tag} Removed {removed:,} running header/footer line(s)", file=sys.stderr)
+    normalized = normalize_text(normalized)
+    chars_before, chars_after = len(text), len(normalized)
+    tokens_before, tokens_after = estimate_tokens(text), estimate_tokens(normalized)
+    print(f"  {tag} Normalized: {chars_before:,} -> {chars_after:,} chars "
+          f"({(chars_after - chars_before) * 100 // max(chars_before, 1)}%), "
+          f"~{tokens_before:,} -> ~{tokens_after:,} tokens "
+          f"({(tokens_after - tokens_before) * 100 // max(tokens_before, 1)}%)", file=sys.stderr)
+    return normalized
+
+
+def read_section_text(text_file: Path, tag: str = "") -> str:
+    """Read a section's extracted text."""
     # Read extracted text with robust UTF-8 error handling
     # pdftotext outputs UTF-8, but may have replacement chars for special glyphs
     try:
@@ -313,49 +2221,553 @@ def process_section(text_file: Path, section_info: Dict[str, Any],
             text = f.read()
     except UnicodeDecodeError:
         # Use UTF-8 with error replacement instead of wrong encoding
-        print("  Warning: UTF-8 decode failed, using error replacement", file=sys.stderr)
+        print(f"  {tag} Warning: UTF-8 decode failed, using error replacement", file=sys.stderr)
         with open(text_file, "r", encoding="utf-8", errors="replace") as f:
             text = f.read()
     
     if not text.strip():
         raise RuntimeError(f"Extracted text is empty: {text_file}")
     
-    char_count = len(text)
-    line_count = text.count('\n') + 1
-    print(f"  Text: {char_count:,} chars, {line_count:,} lines", file=sys.stderr)
+    return text
+
+
+def section_output_files(section_info: Dict[str, Any], output_dir: Path) -> Tuple[Path, Path]:
+    """Return the (summary_file, index_file) paths for a section."""
+    source_name = section_info.get("source_name", "document")
+    section_name = section_info["name"]
+    return (output_dir / f"{source_name}.digest.{section_name}.md",
+            output_dir / f"{source_name}.index.{section_name}.json")
+
+
+def write_section_outputs(section_info: Dict[str, Any], output_dir: Path,
+                          summary: Optional[str], index: Optional[Dict[str, Any]],
+                          index_format: str = "json") -> Tuple[Path, Path]:
+    """Write whichever of summary/index is available; return (summary_file, index_file).
+    
+    Indexes are written by index-merge.py's write_index, which picks the file
+    suffix for index_format and removes the section's index left behind in
+    another format.
+    """
+    tag = f"[{section_info['name']}]"
+    summary_file, index_file = section_output_files(section_info, output_dir)
     
-    # Generate summary
-    print("  Generating summary with AI...", file=sys.stderr)
-    summary = ai_processor.generate_summary(text, section_info)
+    if summary is not None:
+        with open(summary_file, "w", encoding="utf-8") as f:
+            f.write(summary)
+        print(f"  {tag} [OK] Summary: {summary_file}", file=sys.stderr)
     
-    # Generate index
-    print("  Generating index with AI...", file=sys.stderr)
-    index = ai_processor.generate_index(text, section_info)
+    if index is not None:
+        index_file = load_sibling("index-merge").write_index(index, index_file, index_format)
+        print(f"  {tag} [OK] Index: {index_file}", file=sys.stderr)
     
-    # Write outputs
-    source_name = section_info.get("source_name", "document")
-    section_name = section_info["name"]
+    return summary_file, index_file
+
+
+def process_section(text_file: Path, section_info: Dict[str, Any], 
+                    output_dir: Path, ai_processor: AIProcessor) -> Dict[str, Path]:
+    """Process a single section: generate summary and index."""
+    
+    # Tag progress lines with the section name: in batch mode several sections
+    # report to stderr at the same time
+    tag = f"[{section_info['name']}]"
+    print(f"Processing section: {section_info['name']}", file=sys.stderr)
+    
+    # Collect statistics for every AI call made for this section
+    stats = CallStats()
+    _call_stats.set(stats)
+    
+    raw_text = read_section_text(text_file, tag)
+    char_count = len(raw_text)
+    line_count = raw_text.count('\n') + 1
+    print(f"  {tag} Text: {char_count:,} chars, {line_count:,} lines", file=sys.stderr)
+    text = prepare_text(raw_text, section_info, ai_processor)
+    
+    # Text too long for one request is condensed to notes on its parts first
+    # (map); the summary and index requests below are then the reduce step
+    text = ai_processor.condense(text, section_info, raw_text)
+    
+    errors = []
+    summary = None
+    index = None
+    
+    if ai_processor.combined:
+        # One request returns both outputs: the source text is billed once
+        print(f"  {tag} Generating summary and index with AI (single request)...", file=sys.stderr)
+        try:
+            summary, index_response = ai_processor.generate_combined(text, section_info)
+        except Exception as e:
+            errors.append(f"combined generation failed: {e}")
+        else:
+            try:
+                index = ai_processor.parse_index(index_response, section_info)
+            except Exception as e:
+                errors.append(f"index generation failed: {e}")
+    else:
+        # Generate summary and index in parallel: both read the same text and
+        # neither depends on the other's output, so they share the client and run
+        # side by side instead of back to back. With prompt caching they run back
+        # to back instead: the index request then reads the source block the
+        # summary request wrote to the cache, rather than both paying for the write
+        print(f"  {tag} Generating summary and index with AI...", file=sys.stderr)
+        with ThreadPoolExecutor(max_workers=1 if ai_processor.prompt_cache else 2) as pool:
+            # (each call runs in a copy of this context so it records into stats)
+            summary_future = pool.submit(contextvars.copy_context().run,
+                                         ai_processor.generate_summary, text, section_info,
+                                         section_output_files(section_info, output_dir)[0])
+            index_future = pool.submit(contextvars.copy_context().run,
+                                       ai_processor.generate_index, text, section_info)
+        
+        # Collect each result independently so one failed call doesn't discard
+        # the other's (already paid for) output
+        try:
+            summary = summary_future.result()
+        except Exception as e:
+            errors.append(f"summary generation failed: {e}")
+        try:
+            index = index_future.result()
+        except Exception as e:
+            errors.append(f"index generation failed: {e}")
     
-    summary_file = output_dir / f"{source_name}.digest.{section_name}.md"
-    index_file = output_dir / f"{source_name}.index.{section_name}.json"
+    summary_file, index_file = write_section_outputs(section_info, output_dir, summary, index,
+                                                     ai_processor.index_format)
     
-    with open(summary_file, "w", encoding="utf-8") as f:
-        f.write(summary)
-    print(f"  [OK] Summary: {summary_file}", file=sys.stderr)
+    counts = stats.as_dict()
+    if counts.get("estimated_input_tokens"):
+        actual = counts.get("input_tokens", 0) + counts.get("cache_write_tokens", 0)
+        if ai_processor.provider == "anthropic":
+            actual += counts.get("cache_read_tokens", 0)
+        print(f"  {tag} Input tokens: ~{counts['estimated_input_tokens']:,} estimated, "
+              f"{actual:,} actual", file=sys.stderr)
+    if counts.get("continuations"):
+        print(f"  {tag} Continued {counts['continuations']} response(s) cut off at max_tokens",
+              file=sys.stderr)
     
-    with open(index_file, "w", encoding="utf-8") as f:
-        json.dump(index, f, indent=2)
-    print(f"  [OK] Index: {index_file}", file=sys.stderr)
+    if errors:
+        raise RuntimeError("; ".join(errors))
     
     return {
         "summary": summary_file,
         "index": index_file,
         "char_count": char_count,
-        "line_count": line_count
+        "line_count": line_count,
+        "ai_stats": stats.as_dict()
     }
 
 
-def main():
+def section_result_json(result: Dict[str, Any], section_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the JSON result record the shell script consumes for one section."""
+    # Convert Windows paths to forward slashes for JSON/bash compatibility
+    return {
+        "success": True,
+        "section": section_info["name"],
+        "summary_file": result["summary"].as_posix(),
+        "index_file": result["index"].as_posix(),
+        "char_count": result["char_count"],
+        "line_count": result["line_count"],
+        "ai_stats": result["ai_stats"]
+    }
+
+
+def load_batch_jobs(metadata: Dict[str, Any], text_dir: Path,
+                    section_filter: Optional[str] = None) -> List[Tuple[Path, Dict[str, Any]]]:
+    """Build (text_file, section_info) jobs for every section in a metadata file.
+    
+    Text files (and chunk plans, if any) are expected where doc-digest.py
+    writes them: <text_dir>/<source_name>.<section>.txt (.chunk-plan.json)
+    Jobs are ordered by section priority (high first) so the most important
+    sections start first when the pool is smaller than the section count.
+    """
+    document = metadata.get("document", {})
+    source_name = Path(document.get("source_pdf", "document.pdf")).name
+    if source_name.endswith(".pdf"):
+        source_name = source_name[:-len(".pdf")]
+    doc_version = str(document.get("version", "unknown"))
+    
+    priority_order = {"high": 0, "medium": 1, "low": 2}
+    sections = [s for s in metadata.get("sections", [])
+                if not section_filter or s.get("name") == section_filter]
+    sections.sort(key=lambda s: priority_order.get(s.get("priority", "medium"), 1))
+    
+    jobs = []
+    for section in sections:
+        section_info = {
+            "name": section["name"],
+            "title": section.get("title", section["name"]),
+            "description": section.get("description", ""),
+            "doc_version": doc_version,
+            "source_name": source_name,
+            "start_page": section.get("start_page"),
+            "end_page": section.get("end_page")
+        }
+        plan_file = text_dir / f"{source_name}.{section['name']}.chunk-plan.json"
+        if plan_file.exists():
+            section_info["chunk_plan"] = str(plan_file)
+        jobs.append((text_dir / f"{source_name}.{section['name']}.txt", section_info))
+    
+    return jobs
+
+
+def setup_cache(args: argparse.Namespace, ai_processor: AIProcessor):
+    """Attach the on-disk response cache (default: under the output dir) unless disabled."""
+    cache_dir = args.cache_dir or (args.output_dir / ".ai-cache" if args.output_dir else None)
+    if args.no_cache or cache_dir is None:
+        if args.page_cache:
+            print("WARNING: --page-cache needs the response cache; page notes won't be cached",
+                  file=sys.stderr)
+        return
+    ai_processor.cache = ResponseCache(
+        cache_dir,
+        max_bytes=int(args.cache_max_mb * 1024 * 1024),
+        max_age_days=args.cache_max_age_days,
+        refresh=args.refresh
+    )
+    if args.page_cache:
+        # Page-block notes live in their own subtree with their own size budget
+        ai_processor.page_cache = ResponseCache(
+            cache_dir / "pages",
+            max_bytes=int(args.cache_max_mb * 1024 * 1024),
+            max_age_days=args.cache_max_age_days,
+            refresh=args.refresh
+        )
+
+
+def setup_rate_limiter(args: argparse.Namespace, ai_processor: AIProcessor):
+    """Attach the shared request/token rate limiter unless disabled."""
+    if args.no_rate_limit:
+        return
+    state_file = args.rate_limit_state or (
+        Path(tempfile.gettempdir()) / f"davinci-tools-ratelimit-{ai_processor.provider}.json"
+    )
+    ai_processor.rate_limiter = RateLimiter(
+        ai_processor.provider,
+        state_file=state_file,
+        limits={
+            "requests": args.rpm,
+            "input_tokens": args.input_tpm,
+            "output_tokens": args.output_tpm
+        }
+    )
+
+
+def print_result(output: Dict[str, Any]):
+    """Print a JSON result line to stdout for the calling process."""
+    print(json.dumps(output), flush=True)
+
+
+def process_batch(jobs: List[Tuple[Path, Dict[str, Any]]], output_dir: Path,
+                  ai_processor: AIProcessor, concurrency: int,
+                  emit: Callable[[Dict[str, Any]], None] = print_result) -> int:
+    """Process many sections on a bounded worker pool.
+    
+    Emits one JSON result per section (printed to stdout by default) as each
+    section finishes (in completion order, not metadata order). A failing
+    section is reported as {"success": false, ...} and does not stop the others.
+    
+    Returns the number of failed sections.
+    """
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(process_section, text_file, section_info, output_dir, ai_processor): section_info
+            for text_file, section_info in jobs
+        }
+        for future in as_completed(futures):
+            section_info = futures[future]
+            try:
+                output = section_result_json(future.result(), section_info)
+            except Exception as e:
+                failures += 1
+                print(f"ERROR: Section '{section_info['name']}' failed: {e}", file=sys.stderr)
+                output = {"success": False, "section": section_info["name"], "error": str(e)}
+            emit(output)
+    
+    return failures
+
+
+def run_batch_api(jobs: List[Tuple[Path, Dict[str, Any]]], output_dir: Path,
+                  ai_processor: AIProcessor, wait: bool = True, poll_interval: float = 60.0,
+                  emit: Callable[[Dict[str, Any]], None] = print_result) -> Optional[int]:
+    """Process sections through the provider's asynchronous batch API.
+    
+    The first invocation submits every summary/index request (or one combined
+    request per section) as a single provider batch and records it in a job
+    manifest (<output_dir>/<source>.batch-manifest.json). Later invocations
+    resume from the manifest: poll until the batch has ended, then run the
+    usual post-processing (summary check, index JSON extraction, file writing)
+    and emit one result per section, as process_batch does.
+    
+    Requests already in the response cache are not submitted. Sections too long
+    for one request are condensed first (AIProcessor.condense), outside the batch.
+    
+    Returns the number of failed sections, or None if the batch is still
+    running and wait is False.
+    """
+    source_name = jobs[0][1]["source_name"]
+    manifest_path = output_dir / f"{source_name}.batch-manifest.json"
+    kinds = ["combined"] if ai_processor.combined else ["summary", "index"]
+    
+    manifest = None
+    if manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        wanted = sorted(info["name"] for _, info in jobs)
+        if manifest.get("status") == "completed":
+            manifest = None  # Previous run finished: start a new batch
+        elif (manifest["provider"], manifest["model"], sorted(manifest["sections"])) != \
+                (ai_processor.provider, ai_processor.model, wanted):
+            raise RuntimeError(f"Pending batch in {manifest_path} was submitted for different "
+                               f"sections or model; delete the manifest to start over")
+        else:
+            print(f"Batch: resuming {manifest.get('batch_id') or '(fully cached)'} "
+                  f"from {manifest_path}", file=sys.stderr)
+    
+    if manifest is None:
+        manifest = {
+            "provider": ai_processor.provider,
+            "model": ai_processor.model,
+            "submitted": datetime.now().isoformat(),
+            "status": "submitted",
+            "batch_id": None,
+            "sections": {}
+        }
+        requests = {}
+        for i, (text_file, section_info) in enumerate(jobs):
+            tag = f"[{section_info['name']}]"
+            raw_text = read_section_text(text_file, tag)
+            entry = {
+                "section_info": section_info,
+                "char_count": len(raw_text),
+                "line_count": raw_text.count('\n') + 1,
+                "requests": {}
+            }
+            text = prepare_text(raw_text, section_info, ai_processor)
+            # The map step for over-long sections runs as ordinary requests now;
+            # only the final (reduce) requests go into the batch
+            text = ai_processor.condense(text, section_info, raw_text)
+            for kind in kinds:
+                # custom_id must match ^[a-zA-Z0-9_-]{1,64}$, so not the section name
+                custom_id = f"s{i:03d}-{kind}"
+                request = {"custom_id": custom_id, "cache_key": None}
+                prompt, system_prompt, source = ai_processor.build_prompt(kind, text, section_info)
+                output_schema = ai_processor.output_schema(kind)
+                if ai_processor.cache is not None:
+                    request["cache_key"] = ai_processor.cache_key(prompt, system_prompt, source, output_schema)
+                    if ai_processor.cache.get(request["cache_key"]) is not None:
+                        request["cached"] = True
+                        entry["requests"][kind] = request
+                        continue
+                requests[custom_id] = ai_processor._build_request(prompt, system_prompt, source, output_schema)
+                entry["requests"][kind] = request
+            manifest["sections"][section_info["name"]] = entry
+        
+        if requests:
+            print(f"Batch: submitting {len(requests)} request(s) for {len(jobs)} section(s)...",
+                  file=sys.stderr)
+            manifest.update(ai_processor.submit_batch(requests, output_dir))
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Batch: manifest saved to {manifest_path}", file=sys.stderr)
+    
+    # Poll until the provider reports the batch as ended
+    results = {}
+    if manifest["batch_id"]:
+        while True:
+            finished, status = ai_processor.batch_status(manifest["batch_id"])
+            print(f"Batch {manifest['batch_id']}: {status}", file=sys.stderr)
+            if finished:
+                break
+            if not wait:
+                return None
+            time.sleep(poll_interval)
+        results = ai_processor.batch_results(manifest["batch_id"])
+    
+    # Post-process each section exactly like process_section would
+    failures = 0
+    for name, entry in manifest["sections"].items():
+        section_info = entry["section_info"]
+        stats = CallStats()
+        _call_stats.set(stats)
+        
+        responses = {}
+        errors = []
+        for kind, request in entry["requests"].items():
+            stats.add(calls=1)
+            if request.get("cached"):
+                cached = ai_processor.cache.get(request["cache_key"]) if ai_processor.cache else None
+                if cached is not None:
+                    stats.add(cache_hits=1)
+                    responses[kind] = cached["text"]
+                else:
+                    errors.append(f"{kind}: cached response disappeared; rerun the batch")
+                continue
+            
+            stats.add(api_calls=1, batch_requests=1)
+            result = results.get(request["custom_id"], {"error": "no result returned"})
+            if "error" in result:
+                errors.append(f"{kind} request failed: {result['error']}")
+                continue
+            ai_processor._record_usage(result.get("usage"))
+            if result.get("stop_reason") in TRUNCATED_STOP_REASONS:
+                # Batch responses are not continued (the request is not kept in the
+                # manifest) and not cached, so a run without --batch retries them
+                stats.add(truncated_responses=1)
+                print(f"  WARNING: [{name}] {kind} response stopped at max_tokens; "
+                      f"process the section without --batch to continue it", file=sys.stderr)
+            elif request["cache_key"] and ai_processor.cache is not None:
+                ai_processor.cache_response(request["cache_key"], result["text"])
+            responses[kind] = result["text"]
+        
+        summary = None
+        index = None
+        index_response = responses.get("index")
+        try:
+            if "combined" in responses:
+                summary, index_response = ai_processor.split_combined(responses["combined"], section_info)
+            elif "summary" in responses:
+                summary = ai_processor.check_summary(responses["summary"], section_info)
+        except Exception as e:
+            errors.append(f"summary generation failed: {e}")
+        if index_response is not None:
+            try:
+                index = ai_processor.parse_index(index_response, section_info)
+            except Exception as e:
+                errors.append(f"index generation failed: {e}")
+        
+        summary_file, index_file = write_section_outputs(section_info, output_dir, summary, index,
+                                                     ai_processor.index_format)
+        
+        if errors:
+            failures += 1
+            print(f"ERROR: Section '{name}' failed: {'; '.join(errors)}", file=sys.stderr)
+            output = {"success": False, "section": name, "error": "; ".join(errors)}
+        else:
+            output = section_result_json({
+                "summary": summary_file,
+                "index": index_file,
+                "char_count": entry["char_count"],
+                "line_count": entry["line_count"],
+                "ai_stats": stats.as_dict()
+            }, section_info)
+        emit(output)
+    
+    manifest["status"] = "completed"
+    manifest["completed"] = datetime.now().isoformat()
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    
+    return failures
+
+
+def serve(ai_processor: AIProcessor, listen: str, default_concurrency: int):
+    """Run as a long-lived local HTTP server holding a warm AIProcessor.
+    
+    The initialized client (with its keep-alive connection pool), response
+    cache and rate limiter persist across jobs, so each job pays no
+    interpreter start, SDK import or TLS handshake. Clients (doc-digest.py
+    with AI_SERVER) POST JSON:
+    
+        POST /section          {"text_file", "section_info", "output_dir"}
+                               -> one JSON result line
+        POST /batch            {"metadata", "output_dir", "text_dir"?, "section"?, "concurrency"?}
+                               -> JSON result lines, streamed as sections finish
+        POST /test-connection  -> {"success", "model"}
+        POST /shutdown         -> stop the server
+        GET  /health           -> {"success", "provider", "model"}
+    
+    Paths in requests are resolved by the server, so send absolute paths.
+    """
+    host, _, port = listen.rpartition(":")
+    
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: Dict[str, Any]):
+            body = (json.dumps(payload) + "\n").encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format: str, *args: Any):
+            print(f"[server] {self.address_string()} {format % args}", file=sys.stderr)
+        
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"success": True, "provider": ai_processor.provider,
+                                      "model": ai_processor.model})
+            else:
+                self._send_json(404, {"success": False, "error": f"Unknown endpoint: {self.path}"})
+        
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                job = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError as e:
+                self._send_json(400, {"success": False, "error": f"Invalid JSON request: {e}"})
+                return
+            
+            if self.path == "/section":
+                section_info = job.get("section_info", {})
+                try:
+                    output_dir = Path(job["output_dir"])
+                    output_dir.mkdir(parents=True, exist_ok=True)
+                    result = process_section(Path(job["text_file"]), section_info, output_dir, ai_processor)
+                    self._send_json(200, section_result_json(result, section_info))
+                except Exception as e:
+                    print(f"ERROR: {e}", file=sys.stderr)
+                    self._send_json(500, {"success": False, "section": section_info.get("name"),
+                                          "error": str(e)})
+            
+            elif self.path == "/batch":
+                try:
+                    output_dir = Path(job["output_dir"])
+                    output_dir.mkdir(parents=True, exist_ok=True)
+                    metadata = load_metadata(Path(job["metadata"]))
+                    jobs = load_batch_jobs(metadata, Path(job.get("text_dir") or output_dir), job.get("section"))
+                    if not jobs:
+                        raise RuntimeError("No sections to process")
+                except Exception as e:
+                    self._send_json(400, {"success": False, "error": str(e)})
+                    return
+                
+                # Stream result lines as sections finish (HTTP/1.0: body ends at close)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                
+                def emit(output: Dict[str, Any]):
+                    self.wfile.write((json.dumps(output) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                
+                process_batch(jobs, output_dir, ai_processor,
+                              int(job.get("concurrency") or default_concurrency), emit)
+            
+            elif self.path == "/test-connection":
+                try:
+                    response = ai_processor.call_ai("Respond with only: OK", use_cache=False)
+                    self._send_json(200, {"success": "OK" in response.upper(), "model": ai_processor.model})
+                except Exception as e:
+                    self._send_json(502, {"success": False, "error": str(e)})
+            
+            elif self.path == "/shutdown":
+                self._send_json(200, {"success": True})
+                threading.Thread(target=server.shutdown, daemon=True).start()
+            
+            else:
+                self._send_json(404, {"success": False, "error": f"Unknown endpoint: {self.path}"})
+    
+    server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+    print(f"Serving {ai_processor.provider} ({ai_processor.model}) on http://{host or '127.0.0.1'}:{port}",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Command-line options (defaults from the environment); also used by doc-digest.py."""
     parser = argparse.ArgumentParser(
         description="AI-powered documentation processing: summaries, indexes, diagrams"
     )
@@ -371,6 +2783,11 @@ def main():
                         help="Section title")
     parser.add_argument("--section-description", default="",
                         help="Section description")
+    parser.add_argument("--start-page", type=int,
+                        help="Document page number of the section's first page (for --page-cache)")
+    parser.add_argument("--chunk-plan", type=Path,
+                        help="Heading-aligned chunk plan from chunk-planner.py, used when the "
+                             "section has to be chunked")
     parser.add_argument("--doc-version", default="unknown",
                         help="Document version")
     parser.add_argument("--source-name",
@@ -385,16 +2802,152 @@ def main():
     parser.add_argument("--max-tokens", type=int, 
                         default=int(os.getenv("AI_MAX_TOKENS", "16384")),
                         help="Max tokens for AI responses")
+    parser.add_argument("--combined", action="store_true",
+                        default=os.getenv("AI_COMBINED", "").lower() in ("1", "true", "yes"),
+                        help="Generate summary and index in a single request "
+                             "(source text sent once; env: AI_COMBINED)")
+    parser.add_argument("--structured-index", action="store_true",
+                        default=os.getenv("AI_STRUCTURED_INDEX", "").lower() in ("1", "true", "yes"),
+                        help="Request the index as structured output matching the index schema "
+                             "(Anthropic tool use, OpenAI json_schema; env: AI_STRUCTURED_INDEX)")
+    parser.add_argument("--json-repair-rounds", type=int,
+                        default=int(os.getenv("AI_JSON_REPAIR_ROUNDS", "2")),
+                        help="Requests that send the model just the excerpt around an index JSON "
+                             "error to fix, after local repairs failed (0 = local only; default: 2)")
+    parser.add_argument("--prompt-cache", action="store_true",
+                        default=os.getenv("AI_PROMPT_CACHE", "").lower() in ("1", "true", "yes"),
+                        help="Mark the source text as a provider prompt-cache prefix "
+                             "(Anthropic cache_control); a section's summary and index "
+                             "requests then run one after the other (env: AI_PROMPT_CACHE)")
+    parser.add_argument("--stream", action="store_true",
+                        default=os.getenv("AI_STREAM", "").lower() in ("1", "true", "yes"),
+                        help="Stream responses, writing the digest file as it is generated "
+                             "(env: AI_STREAM)")
+    parser.add_argument("--base-url", default=os.getenv("AI_BASE_URL"),
+                        help="Override the provider API endpoint (e.g. a local stand-in server)")
+    parser.add_argument("--max-retries", type=int,
+                        default=int(os.getenv("AI_MAX_RETRIES", "5")),
+                        help="Retries for transient API errors: 429, overloaded, 5xx, "
+                             "connection errors, timeouts (default: 5)")
+    parser.add_argument("--max-continuations", type=int,
+                        default=int(os.getenv("AI_MAX_CONTINUATIONS", "3")),
+                        help="Follow-up requests that continue a response cut off at max_tokens "
+                             "(0 = off; default: 3)")
+    parser.add_argument("--no-normalize", dest="normalize", action="store_false",
+                        default=os.getenv("AI_NORMALIZE", "true").lower() in ("1", "true", "yes"),
+                        help="Send the extracted text as is, without removing running headers/footers, "
+                             "layout whitespace, dot leaders, page numbers and line wraps "
+                             "(env: AI_NORMALIZE=false)")
+    parser.add_argument("--context-window", type=int, default=os.getenv("AI_CONTEXT_WINDOW"),
+                        help="Model context window in tokens (default: known size for the model)")
+    parser.add_argument("--context-fraction", type=float,
+                        default=float(os.getenv("AI_CONTEXT_FRACTION", "0.6")),
+                        help="Share of the context window one request may fill; longer source text "
+                             "is summarized in page-aligned chunks and reduced (default: 0.6)")
+    parser.add_argument("--chunk-tokens", type=int, default=os.getenv("AI_CHUNK_TOKENS"),
+                        help="Cap on chunk size in tokens, for more parallel chunks "
+                             "(default: as large as the context budget allows)")
+    parser.add_argument("--count-tokens", action="store_true",
+                        default=os.getenv("AI_COUNT_TOKENS", "").lower() in ("1", "true", "yes"),
+                        help="Use the provider's token counting endpoint to size requests "
+                             "(Anthropic; otherwise local estimate; env: AI_COUNT_TOKENS)")
+    parser.add_argument("--chunk-concurrency", type=int,
+                        default=int(os.getenv("AI_CHUNK_CONCURRENCY", "4")),
+                        help="Chunk requests run in parallel per section (default: 4)")
+    parser.add_argument("--no-rate-limit", action="store_true",
+                        help="Disable client-side rate limiting")
+    parser.add_argument("--rpm", type=float, default=os.getenv("AI_RPM"),
+                        help="Requests per minute limit until the provider reports one (env: AI_RPM)")
+    parser.add_argument("--input-tpm", type=float, default=os.getenv("AI_INPUT_TPM"),
+                        help="Input tokens per minute limit until the provider reports one (env: AI_INPUT_TPM)")
+    parser.add_argument("--output-tpm", type=float, default=os.getenv("AI_OUTPUT_TPM"),
+                        help="Output tokens per minute limit until the provider reports one (env: AI_OUTPUT_TPM)")
+    parser.add_argument("--rate-limit-state", type=Path, default=os.getenv("AI_RATE_LIMIT_STATE"),
+                        help="Rate limiter state file shared between processes "
+                             "(default: davinci-tools-ratelimit-<provider>.json in the temp dir)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Disable the on-disk AI response cache")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ignore cached AI responses (fresh responses are still cached)")
+    parser.add_argument("--cache-dir", type=Path, default=os.getenv("AI_CACHE_DIR"),
+                        help="Response cache directory (default: <output-dir>/.ai-cache)")
+    parser.add_argument("--cache-max-mb", type=float,
+                        default=float(os.getenv("AI_CACHE_MAX_MB", "512")),
+                        help="Response cache size limit in MB (default: 512)")
+    parser.add_argument("--cache-max-age-days", type=float,
+                        default=float(os.getenv("AI_CACHE_MAX_AGE_DAYS", "30")),
+                        help="Drop cached responses older than this (default: 30)")
+    parser.add_argument("--page-cache", action="store_true",
+                        default=os.getenv("AI_PAGE_CACHE", "").lower() in ("1", "true", "yes"),
+                        help="Digest sections from cached page-block notes, so changed or overlapping "
+                             "page ranges only pay for uncached pages (needs the response cache and "
+                             "section start pages; env: AI_PAGE_CACHE)")
+    parser.add_argument("--page-block", type=int,
+                        default=int(os.getenv("AI_PAGE_BLOCK", "8")),
+                        help="With --page-cache: pages per cached block (default: 8)")
+    parser.add_argument("--index-format", choices=["json", "minified", "jsonl", "binary"],
+                        default=os.getenv("INDEX_FORMAT", "json"),
+                        help="Index file encoding: indented JSON, minified JSON, JSON Lines, or "
+                             "MessagePack/CBOR when installed (see index-merge.py; env: INDEX_FORMAT)")
+    parser.add_argument("--metadata", "--jobs-file", dest="metadata", type=Path,
+                        help="Metadata mode: process every section in this metadata file "
+                             "(emits one JSON result line per section)")
+    parser.add_argument("--section",
+                        help="Metadata mode: only process this section")
+    parser.add_argument("--text-dir", type=Path,
+                        help="Metadata mode: directory holding extracted text (default: --output-dir)")
+    parser.add_argument("--concurrency", type=int,
+                        default=int(os.getenv("AI_CONCURRENCY", "4")),
+                        help="Metadata mode: max sections processed in parallel (default: 4)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Metadata mode: submit all requests through the provider's asynchronous "
+                             "batch API (re-run the same command to resume a pending batch)")
+    parser.add_argument("--no-wait", action="store_true",
+                        help="With --batch: check the batch once instead of polling until done "
+                             "(exit status 2 while it is still running)")
+    parser.add_argument("--poll-interval", type=float, default=60.0,
+                        help="With --batch: seconds between status checks (default: 60)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run as a persistent local HTTP server accepting section jobs "
+                             "(keeps the client and its connections warm)")
+    parser.add_argument("--listen", default=os.getenv("AI_SERVER_LISTEN", "127.0.0.1:8765"),
+                        help="With --serve: host:port to listen on (default: 127.0.0.1:8765)")
     
-    args = parser.parse_args()
+    return parser
+
+
+def create_processor(args: argparse.Namespace) -> AIProcessor:
+    """AIProcessor configured from parsed command-line options (see build_parser)."""
+    ai_processor = AIProcessor(
+        provider=args.provider,
+        model=args.model,
+        max_tokens=args.max_tokens,
+        combined=args.combined,
+        prompt_cache=args.prompt_cache,
+        base_url=args.base_url,
+        stream=args.stream,
+        max_retries=args.max_retries,
+        chunk_tokens=args.chunk_tokens,
+        chunk_concurrency=args.chunk_concurrency,
+        context_window=args.context_window,
+        context_fraction=args.context_fraction,
+        count_tokens=args.count_tokens,
+        page_block=args.page_block,
+        normalize=args.normalize,
+        max_continuations=args.max_continuations,
+        structured_index=args.structured_index,
+        json_repair_rounds=args.json_repair_rounds
+    )
+    ai_processor.index_format = args.index_format
+    return ai_processor
+
+
+def main():
+    args = build_parser().parse_args()
     
     # Setup AI processor
     try:
-        ai_processor = AIProcessor(
-            provider=args.provider,
-            model=args.model,
-            max_tokens=args.max_tokens
-        )
+        ai_processor = create_processor(args)
     except Exception as e:
         print(f"ERROR: Failed to setup AI processor: {e}", file=sys.stderr)
         sys.exit(1)
@@ -403,7 +2956,7 @@ def main():
     if args.test_connection:
         try:
             print(f"Testing {args.provider} API connection...")
-            response = ai_processor.call_ai("Respond with only: OK")
+            response = ai_processor.call_ai("Respond with only: OK", use_cache=False)
             if "OK" in response.upper():
                 print(f"[OK] Connection successful (model: {ai_processor.model})")
                 sys.exit(0)
@@ -454,6 +3007,53 @@ def main():
             print(f"ERROR: Failed to query models: {e}", file=sys.stderr)
             sys.exit(1)
     
+    # Handle server mode: stay resident and accept jobs over HTTP
+    if args.serve:
+        if not (args.cache_dir or args.output_dir) and not args.no_cache:
+            print("WARNING: No --cache-dir or --output-dir: response cache disabled", file=sys.stderr)
+        setup_cache(args, ai_processor)
+        setup_rate_limiter(args, ai_processor)
+        serve(ai_processor, args.listen, args.concurrency)
+        sys.exit(0)
+    
+    # Handle batch mode: all sections of a metadata file in one process
+    if args.metadata:
+        if not args.output_dir:
+            print("ERROR: --output-dir is required", file=sys.stderr)
+            sys.exit(1)
+        
+        try:
+            metadata = load_metadata(args.metadata)
+        except Exception as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            sys.exit(1)
+        
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        setup_cache(args, ai_processor)
+        setup_rate_limiter(args, ai_processor)
+        jobs = load_batch_jobs(metadata, args.text_dir or args.output_dir, args.section)
+        if not jobs:
+            print("ERROR: No sections to process", file=sys.stderr)
+            sys.exit(1)
+        
+        if args.batch:
+            try:
+                failures = run_batch_api(jobs, args.output_dir, ai_processor,
+                                         wait=not args.no_wait, poll_interval=args.poll_interval)
+            except Exception as e:
+                print(f"ERROR: {e}", file=sys.stderr)
+                sys.exit(1)
+            if failures is None:
+                print("Batch still in progress: re-run the same command to resume", file=sys.stderr)
+                sys.exit(2)
+        else:
+            print(f"Batch: {len(jobs)} section(s), concurrency {args.concurrency}", file=sys.stderr)
+            failures = process_batch(jobs, args.output_dir, ai_processor, args.concurrency)
+        if failures:
+            print(f"ERROR: {failures} of {len(jobs)} section(s) failed", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+    
     # Validate inputs for normal processing mode
     if not args.text_file:
         print("ERROR: --text-file is required", file=sys.stderr)
@@ -477,17 +3077,8 @@ def main():
         sys.exit(1)
     
     args.output_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Setup AI processor
-    try:
-        ai_processor = AIProcessor(
-            provider=args.provider,
-            model=args.model,
-            max_tokens=args.max_tokens
-        )
-    except Exception as e:
-        print(f"ERROR: Failed to setup AI processor: {e}", file=sys.stderr)
-        sys.exit(1)
+    setup_cache(args, ai_processor)
+    setup_rate_limiter(args, ai_processor)
     
     # Build section info
     section_info = {
@@ -495,7 +3086,9 @@ def main():
         "title": args.section_title,
         "description": args.section_description,
         "doc_version": args.doc_version,
-        "source_name": args.source_name
+        "source_name": args.source_name,
+        "start_page": args.start_page,
+        "chunk_plan": str(args.chunk_plan) if args.chunk_plan else None
     }
     
     # Process section
@@ -503,15 +3096,7 @@ def main():
         result = process_section(args.text_file, section_info, args.output_dir, ai_processor)
         
         # Output results as JSON for shell script consumption
-        # Convert Windows paths to forward slashes for JSON/bash compatibility
-        output = {
-            "success": True,
-            "summary_file": result["summary"].as_posix(),
-            "index_file": result["index"].as_posix(),
-            "char_count": result["char_count"],
-            "line_count": result["line_count"]
-        }
-        print(json.dumps(output))
+        print(json.dumps(section_result_json(result, section_info)))
     
     except Exception as e:
         print(f"ERROR: {e}", file=sys.stderr)
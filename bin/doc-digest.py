@@ -0,0 +1,683 @@
+#!/usr/bin/env python3
+"""
+doc-digest.py - Documentation digest pipeline, run in a single process
+
+Processes PDF documentation sections defined in a metadata file:
+    1. Validates inputs (metadata, source PDF, page ranges)
+    2. Slices PDF into sections in one pass (pikepdf)
+    3. Extracts text using pdftotext (once per source PDF, into a per-page store)
+    4. Plans heading-aligned chunks for long sections
+    5. Generates AI-powered summaries and indexes
+    6. Creates consolidated artifacts (master index, quick reference)
+    7. Logs all operations for reproducibility
+
+The sibling scripts (metadata-parser.py, pdf-slicer.py, page-store.py,
+chunk-planner.py, doc-ai-processor.py, index-merge.py) are loaded as
+modules, so metadata, sections and AI results stay Python objects for the
+whole run instead of being re-parsed by jq and handed between processes.
+doc-digest.sh is a thin wrapper around this script.
+
+Usage:
+    doc-digest.py --metadata <metadata-file> [--section NAME] [--skip-ai] [--batch] [--no-cache] [--refresh]
+    doc-digest.py --artifacts-only --output-dir DIR --source-name NAME
+
+    --batch           Submit AI requests through the provider batch API (cheaper, slow);
+                      re-run the same command to resume an interrupted batch
+    --no-cache        Don't use the on-disk AI response cache (<output-dir>/.ai-cache)
+    --refresh         Re-query the AI for every request, replacing cached responses
+    --artifacts-only  Only (re)build the master index and quick reference from the
+                      digest and index files already in DIR
+
+Environment:
+    OUTPUT_DIR, OUTPUT_DIR_OVERRIDE  Output directory (default: the metadata file's
+                                     directory, unless OUTPUT_DIR_OVERRIDE is set)
+    LOG_DIR                          Run logs (default: <workspace>/logs)
+    AI_PROVIDER, AI_MODEL, AI_MAX_TOKENS, AI_CONCURRENCY, AI_COMBINED,
+    AI_STRUCTURED_INDEX, AI_PROMPT_CACHE, AI_STREAM, AI_PAGE_CACHE, ...
+                                     AI stage options (see doc-ai-processor.py --help)
+    AI_BATCH, AI_CACHE, AI_CACHE_REFRESH  Same as --batch, (not) --no-cache, --refresh
+    INDEX_FORMAT                     Index files: json, minified, jsonl or binary
+    PAGE_STORE_DIR                   Per-page text stores (default: <output-dir>/.page-store)
+    CHUNK_PLAN_FONTS                 true: chunk planner also uses font sizes (pdftotext -bbox)
+    AI_SERVER                        URL of a running 'doc-ai-processor.py --serve'
+
+Exit codes:
+    0 - Success
+    1 - Error
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from siblings import load_sibling
+
+
+WORKSPACE_ROOT = Path(__file__).resolve().parent.parent
+
+# Color output
+RED = "\033[0;31m"
+GREEN = "\033[0;32m"
+YELLOW = "\033[1;33m"
+BLUE = "\033[0;34m"
+NC = "\033[0m"
+
+
+def env_flag(name: str, default: str = "false") -> bool:
+    """True if an environment variable is set to true/1/yes."""
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+class PipelineError(Exception):
+    """Aborts the pipeline; the message is logged and reported by main()."""
+
+
+class RunLog:
+    """Timestamped run log file plus colored console messages."""
+    
+    def __init__(self, log_file: Path):
+        self.path = log_file
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+    
+    def log(self, level: str, message: str):
+        """Write a line to the log file only."""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(f"[{timestamp}] [{level}] {message}\n")
+    
+    def info(self, message: str):
+        self.log("INFO", message)
+        print(f"{GREEN}[INFO]{NC} {message}", flush=True)
+    
+    def warn(self, message: str):
+        self.log("WARN", message)
+        print(f"{YELLOW}[WARN]{NC} {message}", flush=True)
+    
+    def error(self, message: str):
+        self.log("ERROR", message)
+        print(f"{RED}[ERROR]{NC} {message}", file=sys.stderr, flush=True)
+    
+    def section(self, title: str):
+        self.log("INFO", f"========== {title} ==========")
+        print(f"\n{BLUE}========== {title} =========={NC}\n", flush=True)
+
+
+def human_size(path: Path) -> str:
+    """File size in the style of `du -h`."""
+    size = float(path.stat().st_size)
+    for unit in ("B", "K", "M", "G"):
+        if size < 1024 or unit == "G":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+def tool_version(command: List[str]) -> str:
+    """First line of a tool's version output."""
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except OSError as e:
+        return f"unavailable ({e})"
+    output = (result.stdout or result.stderr).strip()
+    return output.splitlines()[0] if output else "unknown"
+
+
+def check_dependencies(log: RunLog):
+    log.section("Checking Dependencies")
+    
+    install_script = Path(__file__).resolve().parent / "doc-tools-install.sh"
+    if subprocess.run([str(install_script), "--check"]).returncode != 0:
+        raise PipelineError(f"Required tools are missing. Run: {install_script}")
+    
+    # Log tool versions
+    log.log("INFO", "Tool versions:")
+    log.log("INFO", f"  pdftotext: {tool_version(['pdftotext', '-v'])}")
+    log.log("INFO", f"  python: {sys.version.split()[0]}")
+    log.log("INFO", f"  pikepdf: {tool_version([sys.executable, '-c', 'import pikepdf; print(pikepdf.__version__)'])}")
+    
+    log.info("✓ All dependencies present")
+
+
+def server_request(server: str, path: str, payload: Optional[Dict[str, Any]] = None,
+                   timeout: Optional[float] = None):
+    """POST a JSON body to the AI server; returns the open response."""
+    request = urllib.request.Request(
+        f"{server.rstrip('/')}{path}",
+        data=json.dumps(payload or {}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def check_ai_connection(log: RunLog, ai_processor, provider: str, server: str):
+    log.section("Validating AI Connection")
+    
+    log.info(f"Testing {provider} API connection...")
+    
+    if server:
+        log.info(f"Using AI server at {server}")
+        try:
+            with server_request(server, "/test-connection", timeout=120) as response:
+                result = json.loads(response.read())
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        if result.get("success") is not True:
+            log.error(f"AI connection test failed: {result.get('error', result)}")
+            raise PipelineError(f"Cannot reach a working AI server at {server} "
+                                f"(start one with: doc-ai-processor.py --serve)")
+    else:
+        try:
+            response = ai_processor.call_ai("Respond with only: OK")
+            if "OK" not in response.upper():
+                raise RuntimeError(f"Unexpected response: {response}")
+        except Exception as e:
+            log.error(f"AI connection test failed: {e}")
+            raise PipelineError("Cannot proceed without valid AI API access. "
+                                "Please check your API key and credentials.")
+    
+    log.info("✓ AI connection validated")
+
+
+def validate_pdf(log: RunLog, pdf_path: Path) -> int:
+    """Page count of the source PDF (details go to the log file)."""
+    if not pdf_path.is_file():
+        raise PipelineError(f"Source PDF not found: {pdf_path}")
+    
+    page_count = load_sibling("page-store").pdf_page_count(pdf_path)
+    
+    log.log("INFO", "PDF Info:")
+    log.log("INFO", f"  Path: {pdf_path}")
+    log.log("INFO", f"  Pages: {page_count}")
+    log.log("INFO", f"  Size: {human_size(pdf_path)}")
+    return page_count
+
+
+def validate_sections(log: RunLog, metadata: Dict[str, Any], page_count: int,
+                      section_filter: Optional[str]) -> List[Dict[str, Any]]:
+    """Sections to process (after --section), with their page ranges checked."""
+    valid_sections = []
+    for section in metadata["sections"]:
+        name = section.get("name")
+        if section_filter and name != section_filter:
+            continue
+        
+        try:
+            start_page, end_page = int(section["start_page"]), int(section["end_page"])
+        except (KeyError, TypeError, ValueError):
+            raise PipelineError(f"Section '{name}': start_page and end_page must be page numbers")
+        
+        if not 1 <= start_page <= page_count:
+            raise PipelineError(f"Section '{name}': start_page {start_page} out of range (1-{page_count})")
+        if not 1 <= end_page <= page_count:
+            raise PipelineError(f"Section '{name}': end_page {end_page} out of range (1-{page_count})")
+        if end_page < start_page:
+            raise PipelineError(f"Section '{name}': end_page ({end_page}) < start_page ({start_page})")
+        
+        log.log("INFO", f"✓ Section '{name}': pages {start_page}-{end_page}")
+        valid_sections.append(dict(section, start_page=start_page, end_page=end_page))
+    
+    if not valid_sections:
+        raise PipelineError("No valid sections to process")
+    return valid_sections
+
+
+def slice_sections(log: RunLog, source_pdf: Path, slices: List[Tuple[int, int, Path]]):
+    """Write every section's PDF in one pass over the source (see pdf-slicer.py)."""
+    log.info(f"Slicing PDF: {len(slices)} section(s) from {source_pdf.name}")
+    
+    slicer = load_sibling("pdf-slicer")
+    started = time.monotonic()
+    try:
+        slicer.slice_pdf(source_pdf, slices)
+    except Exception as e:
+        raise PipelineError(f"Failed to slice PDF: {e}")
+    
+    log.log("INFO", f"  Sliced in {time.monotonic() - started:.1f}s")
+    for first, last, output_pdf in slices:
+        log.log("INFO", f"  Output: pages {first}-{last} -> {output_pdf} ({human_size(output_pdf)})")
+
+
+def extract_text(log: RunLog, store, start_page: int, end_page: int, text_file: Path) -> bool:
+    """Write a section's text (pages start..end) from the page store; False if empty."""
+    log.info(f"Extracting text: pages {start_page}-{end_page} -> {text_file}")
+    
+    try:
+        text = "".join(f"{page_text}\f" for _, page_text in store.pages(start_page, end_page))
+    except Exception as e:
+        raise PipelineError(f"Failed to extract text: {e}")
+    with open(text_file, "w", encoding="utf-8") as f:
+        f.write(text)
+    
+    char_count = len(text.encode("utf-8"))
+    if char_count == 0:
+        log.warn("Extracted text is empty!")
+        return False
+    
+    log.log("INFO", f"  Text: {char_count} chars, {text.count(chr(10))} lines")
+    return True
+
+
+def plan_chunks(log: RunLog, source_pdf: Path, start_page: int, end_page: int,
+                text_file: Path, plan_file: Path):
+    """Write the heading-aligned chunk plan for a section's text.
+    
+    Used by the AI stage when the section is too long for one request; if
+    planning fails, it falls back to size-based chunking without a plan.
+    """
+    planner = load_sibling("chunk-planner")
+    try:
+        text = text_file.read_text(encoding="utf-8", errors="replace")
+        large_lines = None
+        if env_flag("CHUNK_PLAN_FONTS"):
+            try:
+                large_lines = planner.font_headings(source_pdf, start_page, end_page)
+            except Exception as e:
+                log.log("WARN", f"Font-size heading detection unavailable, using text heuristics: {e}")
+        plan = planner.plan_segments(text, start_page, 2000, large_lines)
+        plan["text_file"] = text_file.as_posix()
+        with open(plan_file, "w", encoding="utf-8") as f:
+            json.dump(plan, f, indent=2)
+    except Exception as e:
+        log.log("WARN", f"Chunk planning failed: {e}")
+        log.warn(f"Chunk planning failed for {text_file} (see log)")
+        plan_file.unlink(missing_ok=True)
+        return
+    
+    log.log("INFO", f"  Chunk plan: {plan_file} ({len(plan['segments'])} segments)")
+
+
+def ai_options(metadata_file: Path, output_dir: Path, section_filter: Optional[str]) -> argparse.Namespace:
+    """doc-ai-processor.py options for this run (the rest default from the environment)."""
+    argv = ["--metadata", str(metadata_file), "--output-dir", str(output_dir)]
+    if section_filter:
+        argv += ["--section", section_filter]
+    if env_flag("AI_BATCH"):
+        argv.append("--batch")
+    if not env_flag("AI_CACHE", "true"):
+        argv.append("--no-cache")
+    if env_flag("AI_CACHE_REFRESH"):
+        argv.append("--refresh")
+    return load_sibling("doc-ai-processor").build_parser().parse_args(argv)
+
+
+def process_all_with_ai(log: RunLog, ai_processor, args: argparse.Namespace,
+                        metadata: Dict[str, Any], source_name: str, server: str):
+    """Run the AI stage for every section and cache each result per section.
+    
+    Sections run on a bounded worker pool (AI_CONCURRENCY), in this process or
+    on the AI server; each successful result is saved as
+    <source>.ai-response.<section>.json for later --skip-ai runs.
+    """
+    processor = load_sibling("doc-ai-processor")
+    output_dir = args.output_dir
+    log.log("INFO", f"Processing with AI (concurrency: {args.concurrency})")
+    
+    results: List[Dict[str, Any]] = []
+    try:
+        if server and not args.batch:
+            # Hand the job to the resident server (warm client, shared cache and
+            # rate limits); provider/model/flags are the server's own settings
+            request = {"metadata": str(args.metadata.resolve()), "output_dir": str(output_dir.resolve()),
+                       "concurrency": args.concurrency}
+            if args.section:
+                request["section"] = args.section
+            with server_request(server, "/batch", request) as response:
+                for line in response:
+                    if line.strip():
+                        results.append(json.loads(line))
+        else:
+            output_dir.mkdir(parents=True, exist_ok=True)
+            processor.setup_cache(args, ai_processor)
+            processor.setup_rate_limiter(args, ai_processor)
+            jobs = processor.load_batch_jobs(metadata, output_dir, args.section)
+            if args.batch:
+                # Asynchronous provider batch: waits (polling) until results are in;
+                # an interrupted run resumes from the batch manifest when re-run
+                log.info("Submitting/polling provider batch (this may take hours)...")
+                processor.run_batch_api(jobs, output_dir, ai_processor, wait=True,
+                                        poll_interval=args.poll_interval, emit=results.append)
+            else:
+                print(f"Batch: {len(jobs)} section(s), concurrency {args.concurrency}", file=sys.stderr)
+                processor.process_batch(jobs, output_dir, ai_processor, args.concurrency,
+                                        emit=results.append)
+    except Exception as e:
+        log.error(f"AI processing failed: {e}")
+        raise PipelineError("AI processing failed: check log for details")
+    finally:
+        # Debug: save what we got for forensics
+        with open(output_dir / "DEBUG-captured-ai-result.txt", "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(result) + "\n" for result in results)
+        log.log("DEBUG", "Captured AI results saved to DEBUG-captured-ai-result.txt")
+    
+    # Cache each successful section result, even if other sections failed
+    failed = False
+    for result in results:
+        name = result.get("section")
+        if result.get("success"):
+            with open(output_dir / f"{source_name}.ai-response.{name}.json", "w", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+            log.log("INFO", f"  {name}: {result.get('summary_file')}, {result.get('index_file')}, "
+                            f"{result.get('char_count')} chars")
+        else:
+            log.error(f"AI processing failed for section '{name}': {result.get('error')}")
+            failed = True
+    
+    if failed:
+        raise PipelineError("AI processing failed: check log for details")
+
+
+def generate_master_index(log: RunLog, output_dir: Path, source_name: str, index_files: List[Path]):
+    """Merge all section indexes, deduplicating concepts, terms and topics across sections."""
+    log.section("Generating Master Index")
+    
+    log.info(f"Combining {len(index_files)} section indexes")
+    
+    merger = load_sibling("index-merge")
+    try:
+        master = merger.master_index(index_files, source_name)
+        # The written file's suffix follows INDEX_FORMAT
+        master_file = merger.write_index(master, output_dir / f"{source_name}.master-index.json",
+                                         os.getenv("INDEX_FORMAT") or "json")
+    except Exception as e:
+        raise PipelineError(f"Failed to generate master index: {e}")
+    
+    log.info(f"✓ Master index: {master_file}")
+
+
+def markdown_block(lines: List[str], heading: str) -> List[str]:
+    """Lines from each `heading` line up to (not including) the next "## " heading."""
+    block = []
+    inside = False
+    for line in lines:
+        if inside and line.startswith("## "):
+            inside = False
+        if not inside and line.startswith(heading):
+            inside = True
+        if inside:
+            block.append(line)
+    return block
+
+
+def generate_quick_reference(log: RunLog, output_dir: Path, source_name: str, summary_files: List[Path]):
+    log.section("Generating Quick Reference")
+    
+    quick_ref = output_dir / f"{source_name}.quick-reference.md"
+    
+    log.info(f"Distilling {len(summary_files)} summaries")
+    
+    parts = [
+        f"# {source_name} - Quick Reference\n",
+        f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n",
+        "\n",
+        "This is a distilled quick reference guide combining key information from all sections.\n",
+        "\n",
+        "---\n",
+        "\n",
+        "\n"
+    ]
+    
+    # Extract overview and key concepts (simplified - could use AI for better distillation)
+    for summary in summary_files:
+        section_name = re.sub(r".*\.digest\.(.*)\.md$", r"\1", summary.name)
+        parts.append(f"## Section: {section_name}\n\n")
+        try:
+            lines = summary.read_text(encoding="utf-8").splitlines(keepends=True)
+        except OSError as e:
+            log.warn(f"Summary file unreadable: {summary} ({e})")
+            lines = []
+        for heading in ("## Overview", "## Key Concepts"):
+            parts.extend(markdown_block(lines, heading))
+        parts.append("\n---\n\n")
+    
+    with open(quick_ref, "w", encoding="utf-8") as f:
+        f.writelines(parts)
+    
+    log.info(f"✓ Quick reference: {quick_ref}")
+
+
+def generate_artifacts(log: RunLog, output_dir: Path, source_name: str,
+                       summary_files: List[Path], index_files: List[Path]):
+    """Master index and quick reference."""
+    generate_master_index(log, output_dir, source_name, index_files)
+    generate_quick_reference(log, output_dir, source_name, summary_files)
+
+
+def clean_forensics(log: RunLog, output_dir: Path):
+    """Remove failure forensics of earlier runs (after a successful pipeline run only:
+    rebuilding artifacts with --artifacts-only resolves no failure)."""
+    log.info("Cleaning up old forensics files...")
+    forensics = list(output_dir.rglob("FAILED-*.txt"))
+    for path in forensics:
+        path.unlink()
+    if forensics:
+        log.info(f"  Removed {len(forensics)} old failure forensics files")
+    else:
+        log.info("  No old forensics files to clean up")
+
+
+def collect_outputs(log: RunLog, output_dir: Path, source_name: str,
+                    section_names: List[str]) -> Tuple[List[Path], List[Path]]:
+    """Summary and index files of each section, from its cached AI response."""
+    summary_files, index_files = [], []
+    for name in section_names:
+        cached_response = output_dir / f"{source_name}.ai-response.{name}.json"
+        if not cached_response.is_file():
+            raise PipelineError(f"Cached AI response not found: {cached_response}\n"
+                                f"       Run without --skip-ai first to generate it.")
+        
+        log.info(f"Using AI response: {cached_response}")
+        with open(cached_response, "r", encoding="utf-8") as f:
+            response = json.load(f)
+        summary_file, index_file = Path(response["summary_file"]), Path(response["index_file"])
+        
+        # Verify the AI stage actually created these files
+        if not summary_file.is_file():
+            log.warn(f"Summary file missing: {summary_file} (AI processing may have failed)")
+        if not index_file.is_file():
+            log.warn(f"Index file missing: {index_file} (AI processing may have failed)")
+        
+        log.log("INFO", f"  Summary: {summary_file}")
+        log.log("INFO", f"  Index: {index_file}")
+        summary_files.append(summary_file)
+        index_files.append(index_file)
+    return summary_files, index_files
+
+
+def run_pipeline(log: RunLog, args: argparse.Namespace, output_dir: Path):
+    metadata_file = args.metadata
+    server = os.getenv("AI_SERVER", "")
+    provider = os.getenv("AI_PROVIDER") or "anthropic"
+    model = os.getenv("AI_MODEL", "")
+    
+    log.section("Documentation Digest Pipeline")
+    log.log("INFO", f"Metadata: {metadata_file}")
+    log.log("INFO", f"Output: {output_dir}")
+    log.log("INFO", f"Log: {log.path}")
+    log.log("INFO", f"AI Provider: {provider} {f'({model})' if model else ''}")
+    
+    check_dependencies(log)
+    
+    # Check AI connection before doing expensive work (skip if using cached)
+    ai_args = ai_processor = None
+    if not args.skip_ai:
+        ai_args = ai_options(metadata_file, output_dir, args.section)
+        if not server or ai_args.batch:
+            try:
+                ai_processor = load_sibling("doc-ai-processor").create_processor(ai_args)
+            except Exception as e:
+                raise PipelineError(f"Failed to setup AI processor: {e}")
+        check_ai_connection(log, ai_processor, provider, server)
+    else:
+        log.warn("Skipping AI processing - using cached results")
+    
+    # Parse and validate metadata
+    log.info(f"Parsing metadata: {metadata_file}")
+    if not metadata_file.is_file():
+        raise PipelineError(f"Metadata file not found: {metadata_file}")
+    try:
+        metadata = load_sibling("metadata-parser").parse_metadata(metadata_file)
+    except Exception as e:
+        raise PipelineError(f"Failed to parse metadata file: {e}")
+    
+    document = metadata["document"]
+    source_pdf = Path(document["source_pdf"])
+    source_name = source_pdf.name[:-len(".pdf")] if source_pdf.name.endswith(".pdf") else source_pdf.name
+    log.log("INFO", f"Document: {document.get('title', 'Document')} (v{document.get('version', 'unknown')})")
+    log.log("INFO", f"Source: {source_pdf}")
+    
+    # Resolve source PDF path
+    if not source_pdf.is_absolute():
+        source_pdf = WORKSPACE_ROOT / source_pdf
+    
+    log.info(f"Validating source PDF: {source_pdf}")
+    page_count = validate_pdf(log, source_pdf)
+    
+    log.section("Validating Sections")
+    sections = validate_sections(log, metadata, page_count, args.section)
+    log.info(f"Processing {len(sections)} section(s)")
+    
+    # Slice and extract each section
+    log.section("Processing Sections")
+    
+    # Per-page text store: pdftotext runs once per source PDF version; later
+    # runs and overlapping sections only look pages up
+    store_dir = Path(os.getenv("PAGE_STORE_DIR") or output_dir / ".page-store")
+    log.info(f"Page store: {store_dir}")
+    try:
+        store = load_sibling("page-store").PageStore(source_pdf, store_dir)
+        store_info = store.build(int(os.getenv("PAGE_STORE_JOBS", "4")))
+    except Exception as e:
+        raise PipelineError(f"Failed to build page store for {source_pdf}: {e}")
+    log.log("INFO", f"  Store: {store_info['path']} ({store_info['page_count']} pages, "
+                    f"built {store_info['created']})")
+    
+    slice_sections(log, source_pdf, [
+        (section["start_page"], section["end_page"], output_dir / f"{source_name}.{section['name']}.pdf")
+        for section in sections
+    ])
+    
+    for i, section in enumerate(sections, 1):
+        name, start_page, end_page = section["name"], section["start_page"], section["end_page"]
+        print()
+        log.info(f"[{i}/{len(sections)}] Section: {name} (pages {start_page}-{end_page})")
+        
+        text_file = output_dir / f"{source_name}.{name}.txt"
+        if not extract_text(log, store, start_page, end_page, text_file):
+            raise PipelineError(f"Failed to process section: {name}")
+        plan_chunks(log, source_pdf, start_page, end_page, text_file,
+                    output_dir / f"{source_name}.{name}.chunk-plan.json")
+    
+    # Process all sections with AI (concurrent workers)
+    if not args.skip_ai:
+        log.section("AI Processing")
+        process_all_with_ai(log, ai_processor, ai_args, metadata, source_name, server)
+    
+    summary_files, index_files = collect_outputs(log, output_dir, source_name,
+                                                 [section["name"] for section in sections])
+    generate_artifacts(log, output_dir, source_name, summary_files, index_files)
+    
+    # Clean up forensics files from previous failures (success = clean slate)
+    clean_forensics(log, output_dir)
+    
+    # Summary
+    log.section("Pipeline Complete")
+    log.info(f"Processed {len(sections)} section(s)")
+    log.info("Generated artifacts:")
+    log.info(f"  - {len(summary_files)} summaries")
+    log.info(f"  - {len(index_files)} indexes")
+    log.info("  - 1 master index")
+    log.info("  - 1 quick reference")
+    log.info(f"Output directory: {output_dir}")
+    log.info(f"Log file: {log.path}")
+    
+    print(f"\n{GREEN}✓ Documentation digest complete!{NC}")
+
+
+def run_artifacts_only(log: RunLog, output_dir: Path, source_name: str):
+    """Rebuild the master index and quick reference from existing section outputs."""
+    suffixes = load_sibling("index-merge").INDEX_SUFFIXES
+    summary_files = sorted(output_dir.glob(f"{source_name}.digest.*.md"))
+    index_files = sorted(p for p in output_dir.glob(f"{source_name}.index.*")
+                         if p.suffix in suffixes)
+    if not summary_files:
+        raise PipelineError(f"No digest files for '{source_name}' in {output_dir}")
+    if not index_files:
+        raise PipelineError(f"No index files for '{source_name}' in {output_dir}")
+    
+    generate_artifacts(log, output_dir, source_name, summary_files, index_files)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Documentation digest pipeline: slice, extract, summarize and index PDF sections"
+    )
+    parser.add_argument("--metadata", type=Path, help="Metadata file (TOML or JSON)")
+    parser.add_argument("--section", help="Only process this section")
+    parser.add_argument("--skip-ai", action="store_true",
+                        help="Use the cached AI responses of an earlier run")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit AI requests through the provider batch API (same as AI_BATCH=true)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Don't use the on-disk AI response cache (same as AI_CACHE=false)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Re-query the AI for every request (same as AI_CACHE_REFRESH=true)")
+    parser.add_argument("--artifacts-only", action="store_true",
+                        help="Only rebuild the master index and quick reference in --output-dir")
+    parser.add_argument("--output-dir", type=Path,
+                        help="Output directory (default: OUTPUT_DIR if OUTPUT_DIR_OVERRIDE is set, "
+                             "else the metadata file's directory)")
+    parser.add_argument("--source-name", help="With --artifacts-only: source PDF name without .pdf")
+    
+    args = parser.parse_args()
+    
+    # Command-line switches win over the environment (the AI stage reads these)
+    if args.batch:
+        os.environ["AI_BATCH"] = "true"
+    if args.no_cache:
+        os.environ["AI_CACHE"] = "false"
+    if args.refresh:
+        os.environ["AI_CACHE_REFRESH"] = "true"
+    
+    if args.artifacts_only:
+        if not args.output_dir or not args.source_name:
+            parser.error("--artifacts-only requires --output-dir and --source-name")
+        output_dir = args.output_dir
+    elif not args.metadata:
+        parser.error("Missing required argument: --metadata")
+    elif args.output_dir:
+        output_dir = args.output_dir
+    elif os.getenv("OUTPUT_DIR_OVERRIDE"):
+        output_dir = Path(os.getenv("OUTPUT_DIR") or WORKSPACE_ROOT / "docs")
+    else:
+        # Output goes next to the metadata file unless explicitly set
+        output_dir = args.metadata.resolve().parent
+    
+    output_dir = output_dir.resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # The AI stage writes failure forensics under OUTPUT_DIR
+    os.environ["OUTPUT_DIR"] = str(output_dir)
+    
+    log_dir = Path(os.getenv("LOG_DIR") or WORKSPACE_ROOT / "logs")
+    log = RunLog(log_dir / f"doc-digest-run-{datetime.now().strftime('%Y%m%d-%H%M%S')}.log")
+    
+    try:
+        if args.artifacts_only:
+            run_artifacts_only(log, output_dir, args.source_name)
+        else:
+            run_pipeline(log, args, output_dir)
+    except PipelineError as e:
+        log.log("ERROR", str(e))
+        print(f"ERROR(doc-digest.py): {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,10 @@
 #
 # Required tools:
 #   - poppler (pdftotext, pdfinfo)
-#   - qpdf (PDF manipulation)
-#   - python (3.13+)
-#   - jq (JSON processing)
+#   - python (3.13+), with pikepdf (PDF slicing)
+#
+# Optional tools (reported by --check, not required):
+#   - jq (JSON processing; used by the bin/test-*.sh scripts)
 
 set -euo pipefail  # Be strict about error handling
 
@@ -93,9 +94,6 @@ die() {
         check_tool_version "pdftotext" "pdftotext -v" || all_present=1
         check_tool_version "pdfinfo" "pdfinfo -v" || all_present=1
         
-        # Check qpdf
-        check_tool_version "qpdf" "qpdf --version" || all_present=1
-        
         # Check Python (require 3.13+)
         if command_exists python; then
             local py_version
@@ -110,13 +108,26 @@ die() {
                 echo "  ✗ python: $py_version (require 3.13+)"
                 all_present=1
             fi
+            
+            # pikepdf slices all sections out of one parse of the source PDF
+            local pikepdf_version
+            if pikepdf_version=$(python -c "import pikepdf; print(pikepdf.__version__)" 2>/dev/null); then
+                echo "  ✓ pikepdf: $pikepdf_version"
+            else
+                echo "  ✗ pikepdf: NOT FOUND (pip install pikepdf)"
+                all_present=1
+            fi
         else
             echo "  ✗ python: NOT FOUND"
             all_present=1
         fi
         
-        # Check jq
-        check_tool_version "jq" "jq --version" || all_present=1
+        echo
+        echo "Checking optional tools..."
+        echo
+        
+        # jq is only used by the test scripts
+        check_tool_version "jq" "jq --version" || true
         
         echo
         return $all_present
@@ -139,14 +150,6 @@ die() {
             log_info "poppler already installed"
         fi
         
-        # Install qpdf
-        if ! command_exists qpdf; then
-            log_info "Installing qpdf..."
-            scoop install qpdf
-        else
-            log_info "qpdf already installed"
-        fi
-        
         # Install Python
         if ! command_exists python; then
             log_info "Installing python..."
@@ -167,18 +170,10 @@ die() {
             fi
         fi
         
-        # Install jq
-        if ! command_exists jq; then
-            log_info "Installing jq..."
-            scoop install jq
-        else
-            log_info "jq already installed"
-        fi
-        
         # Install Python packages
         log_info "Installing required Python packages..."
         python -m pip install --upgrade pip
-        python -m pip install anthropic openai tomli
+        python -m pip install anthropic openai tomli pikepdf
         
         echo
         log_info "Installation complete!"
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+index-merge.py - Merge index JSON files (per chunk or per section) without duplicates
+
+Merges indexes in the schema doc-ai-processor.py generates (concepts, terms,
+topics, patterns, cross_refs). Entries are deduplicated by a normalized key
+(case, spacing and punctuation ignored): concepts keep the highest relevance
+and the most detailed description, terms the most detailed definition,
+topics union their subtopics and keywords, patterns and cross-references are
+unioned. Everything goes through hash maps in first-seen order, so merging
+is linear in the total number of entries, for thousands of indexes too.
+
+Usage:
+    index-merge.py <index>... [--section NAME] [--title TITLE] [--format F] [--output FILE]
+    index-merge.py --master --source NAME <index>... [--format F] [--output FILE]
+
+The first form writes one merged index (e.g. a section's index from its
+chunk indexes); --master writes the document's master index, recording
+which sections each entry came from.
+
+Index files are read in any of the --format encodings (by file suffix):
+    json     - indented JSON (.json, the default)
+    minified - JSON without whitespace (.json)
+    jsonl    - JSON Lines, one line per entry (.jsonl)
+    binary   - MessagePack (.msgpack) or CBOR (.cbor), whichever is installed;
+               minified JSON without either
+With --output, the suffix of FILE is replaced to match the format and the
+name of the file written is printed.
+
+Exit codes:
+    0 - Success
+    1 - Error
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional
+
+# Compact binary index encodings (optional; --format binary falls back to minified JSON)
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import cbor2
+    CBOR_AVAILABLE = True
+except ImportError:
+    CBOR_AVAILABLE = False
+
+
+INDEX_FORMATS = ["json", "minified", "jsonl", "binary"]
+INDEX_SUFFIXES = [".json", ".jsonl", ".msgpack", ".cbor"]
+RELEVANCE_RANK = {"high": 3, "medium": 2, "low": 1}
+PATTERN_KINDS = ["how_to", "what_is", "troubleshooting"]
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def merge_key(value: Any) -> str:
+    """Normalized deduplication key: case, spacing and punctuation ignored."""
+    return _NON_WORD.sub(" ", str(value)).strip().lower()
+
+
+def longer(current: Any, candidate: Any) -> Any:
+    """The more detailed (longer) of two text values."""
+    return candidate if len(str(candidate or "")) > len(str(current or "")) else current
+
+
+class IndexMerger:
+    """Accumulates indexes; each add() is linear in the size of the index added."""
+    
+    def __init__(self):
+        self.concepts: Dict[str, Dict[str, Any]] = {}
+        self.terms: Dict[str, Dict[str, Any]] = {}
+        self.topics: Dict[str, Dict[str, Any]] = {}
+        self.patterns: Dict[str, Dict[str, str]] = {}
+        self.cross_refs: Dict[tuple, Dict[str, Any]] = {}
+        # Union helpers for list fields: entry key -> {item key: None}
+        self._topic_items: Dict[str, Dict[str, Dict[str, None]]] = {}
+        self._term_contexts: Dict[str, Dict[str, None]] = {}
+        self._sources: Dict[tuple, Dict[str, None]] = {}  # (kind, entry key) -> sources
+    
+    def _tag(self, kind: str, key: Any, source: Optional[str]):
+        """Record that an entry came (also) from source."""
+        if source is not None:
+            self._sources.setdefault((kind, key), {})[source] = None
+    
+    def add(self, index: Dict[str, Any], source: Optional[str] = None):
+        """Merge one index into the accumulated result."""
+        for concept in index.get("concepts") or []:
+            if not isinstance(concept, dict) or not concept.get("name"):
+                continue
+            key = merge_key(concept["name"])
+            merged = self.concepts.get(key)
+            if merged is None:
+                merged = self.concepts[key] = dict(concept)
+            else:
+                merged["description"] = longer(merged.get("description"), concept.get("description"))
+                if RELEVANCE_RANK.get(concept.get("relevance"), 0) > RELEVANCE_RANK.get(merged.get("relevance"), 0):
+                    merged["relevance"] = concept["relevance"]
+            self._tag("concepts", key, source)
+        
+        for term in index.get("terms") or []:
+            if not isinstance(term, dict) or not term.get("term"):
+                continue
+            key = merge_key(term["term"])
+            merged = self.terms.get(key)
+            if merged is None:
+                merged = self.terms[key] = dict(term)
+                self._term_contexts[key] = {}
+            else:
+                merged["definition"] = longer(merged.get("definition"), term.get("definition"))
+            if term.get("context"):
+                self._term_contexts[key][str(term["context"])] = None
+            self._tag("terms", key, source)
+        
+        for topic in index.get("topics") or []:
+            if not isinstance(topic, dict) or not topic.get("category"):
+                continue
+            key = merge_key(topic["category"])
+            merged = self.topics.get(key)
+            if merged is None:
+                merged = self.topics[key] = {"category": topic["category"], "subtopics": [], "keywords": []}
+                self._topic_items[key] = {"subtopics": {}, "keywords": {}}
+            for field in ("subtopics", "keywords"):
+                seen = self._topic_items[key][field]
+                for item in topic.get(field) or []:
+                    item_key = merge_key(item)
+                    if item_key and item_key not in seen:
+                        seen[item_key] = None
+                        merged[field].append(item)
+            self._tag("topics", key, source)
+        
+        patterns = index.get("patterns") or {}
+        if isinstance(patterns, dict):
+            for kind, items in patterns.items():
+                seen = self.patterns.setdefault(kind, {})
+                for item in items or []:
+                    seen.setdefault(merge_key(item), item)
+        
+        for ref in index.get("cross_refs") or []:
+            if not isinstance(ref, dict):
+                continue
+            key = (merge_key(ref.get("from", "")), merge_key(ref.get("to", "")),
+                   merge_key(ref.get("relationship", "")))
+            self.cross_refs.setdefault(key, dict(ref))
+            self._tag("cross_refs", key, source)
+    
+    def _entries(self, kind: str, entries: Dict[Any, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Merged entries in first-seen order, with their sources if any were given."""
+        result = []
+        for key, entry in entries.items():
+            if kind == "terms" and self._term_contexts[key]:
+                entry = dict(entry, context="; ".join(self._term_contexts[key]))
+            if (kind, key) in self._sources:
+                entry = dict(entry, sections=list(self._sources[(kind, key)]))
+            result.append(entry)
+        return result
+    
+    def _patterns(self) -> Dict[str, List[str]]:
+        kinds = PATTERN_KINDS + [kind for kind in self.patterns if kind not in PATTERN_KINDS]
+        return {kind: list(self.patterns.get(kind, {}).values()) for kind in kinds}
+    
+    def index(self, section: str, title: str) -> Dict[str, Any]:
+        """The merged result as one index (same schema as a generated index)."""
+        return {
+            "section": section,
+            "title": title,
+            "concepts": self._entries("concepts", self.concepts),
+            "terms": self._entries("terms", self.terms),
+            "topics": self._entries("topics", self.topics),
+            "patterns": self._patterns(),
+            "cross_refs": self._entries("cross_refs", self.cross_refs)
+        }
+
+
+def index_path(path: Path, index_format: str) -> Path:
+    """path with the suffix index_format is written with."""
+    if index_format == "jsonl":
+        return path.with_suffix(".jsonl")
+    if index_format == "binary" and MSGPACK_AVAILABLE:
+        return path.with_suffix(".msgpack")
+    if index_format == "binary" and CBOR_AVAILABLE:
+        return path.with_suffix(".cbor")
+    return path.with_suffix(".json")
+
+
+def encode_index(data: Dict[str, Any], index_format: str) -> bytes:
+    """Encode an index (or master index) in index_format."""
+    if index_format == "json":
+        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    
+    if index_format == "jsonl":
+        # A header line with the scalar fields (and the names of the list
+        # fields, so empty lists survive), then one line per list entry
+        lists = [key for key, value in data.items() if isinstance(value, list)]
+        header = {key: value for key, value in data.items() if key not in lists}
+        lines = [{"type": "header", "fields": header, "lists": lists}]
+        lines.extend({"type": key, "value": entry} for key in lists for entry in data[key])
+        return "".join(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n"
+                       for line in lines).encode("utf-8")
+    
+    if index_format == "binary" and MSGPACK_AVAILABLE:
+        return msgpack.packb(data, use_bin_type=True)
+    if index_format == "binary" and CBOR_AVAILABLE:
+        return cbor2.dumps(data)
+    
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_index(raw: bytes, suffix: str) -> Dict[str, Any]:
+    """Decode an index file's contents; suffix tells the encoding."""
+    if suffix == ".msgpack":
+        if not MSGPACK_AVAILABLE:
+            raise RuntimeError("msgpack package not installed. Run: pip install msgpack")
+        return msgpack.unpackb(raw, raw=False)
+    if suffix == ".cbor":
+        if not CBOR_AVAILABLE:
+            raise RuntimeError("cbor2 package not installed. Run: pip install cbor2")
+        return cbor2.loads(raw)
+    
+    if suffix == ".jsonl":
+        data: Dict[str, Any] = {}
+        for line in raw.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("type") == "header":
+                data.update(record.get("fields") or {})
+                for key in record.get("lists") or []:
+                    data.setdefault(key, [])
+            else:
+                data.setdefault(record["type"], []).append(record["value"])
+        return data
+    
+    return json.loads(raw)
+
+
+def read_index(path: Path) -> Dict[str, Any]:
+    """Read an index file written in any of INDEX_FORMATS."""
+    with open(path, "rb") as f:
+        return decode_index(f.read(), path.suffix)
+
+
+def write_index(data: Dict[str, Any], path: Path, index_format: str = "json") -> Path:
+    """Write an index in index_format; return the file written.
+    
+    path's suffix is replaced to match the format (see index_path), and the
+    same index left behind in another format is removed, so readers that
+    glob for index files never see two versions of it.
+    """
+    target = index_path(path, index_format)
+    tmp_file = target.with_name(f"{target.name}.tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(encode_index(data, index_format))
+    tmp_file.replace(target)
+    
+    for suffix in INDEX_SUFFIXES:
+        stale = target.with_suffix(suffix)
+        if stale != target and stale.exists():
+            stale.unlink()
+    return target
+
+
+def merge_indexes(indexes: Iterable[Dict[str, Any]], section: str, title: str) -> Dict[str, Any]:
+    """Merge indexes (e.g. one per chunk) into one index for section."""
+    merger = IndexMerger()
+    for index in indexes:
+        merger.add(index)
+    return merger.index(section, title)
+
+
+def master_index(index_files: List[Path], source: str) -> Dict[str, Any]:
+    """Build the master index of a document from its section index files."""
+    merger = IndexMerger()
+    sections = []
+    for index_file in index_files:
+        data = read_index(Path(index_file))
+        name = data.get("section", "unknown")
+        sections.append({
+            "name": name,
+            "title": data.get("title", "Unknown"),
+            "index_file": str(index_file)
+        })
+        merger.add(data, source=name)
+    
+    merged = merger.index(source, source)
+    return {
+        "source": source,
+        "sections": sections,
+        "all_concepts": merged["concepts"],
+        "all_terms": merged["terms"],
+        "all_topics": merged["topics"],
+        "all_patterns": merged["patterns"],
+        "all_cross_refs": merged["cross_refs"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge index JSON files without duplicates"
+    )
+    parser.add_argument("index_files", type=Path, nargs="+", help="Index JSON files to merge")
+    parser.add_argument("--master", action="store_true",
+                        help="Write a master index over section indexes")
+    parser.add_argument("--source", default="",
+                        help="With --master: source document name")
+    parser.add_argument("--section", default="merged",
+                        help="Section name of the merged index (default: merged)")
+    parser.add_argument("--title", default="",
+                        help="Title of the merged index")
+    parser.add_argument("--format", dest="index_format", choices=INDEX_FORMATS,
+                        default=os.getenv("INDEX_FORMAT", "json"),
+                        help="Output encoding (default: json; env: INDEX_FORMAT)")
+    parser.add_argument("--output", type=Path,
+                        help="Write to this file (suffix set by --format) and print its name "
+                             "(default: stdout)")
+    
+    args = parser.parse_args()
+    
+    try:
+        if args.master:
+            result = master_index(args.index_files, args.source)
+            counts = {key: len(result[key]) for key in ("all_concepts", "all_terms", "all_topics")}
+        else:
+            indexes = [read_index(index_file) for index_file in args.index_files]
+            result = merge_indexes(indexes, args.section, args.title or args.section)
+            counts = {key: len(result[key]) for key in ("concepts", "terms", "topics")}
+        
+        print(f"Merged {len(args.index_files)} index(es): "
+              + ", ".join(f"{count} {key.replace('all_', '')}" for key, count in counts.items()),
+              file=sys.stderr)
+        if args.index_format == "binary" and not (MSGPACK_AVAILABLE or CBOR_AVAILABLE):
+            print("WARNING: Neither msgpack nor cbor2 is installed; writing minified JSON",
+                  file=sys.stderr)
+        if args.output:
+            print(write_index(result, args.output, args.index_format).as_posix())
+        else:
+            sys.stdout.buffer.write(encode_index(result, args.index_format))
+            if index_path(Path("-"), args.index_format).suffix == ".json":
+                sys.stdout.buffer.write(b"\n")
+    
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
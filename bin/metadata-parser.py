@@ -15,6 +15,44 @@ Exit codes:
 import sys
 import json
 from pathlib import Path
+from typing import Dict, Any
+
+
+def parse_metadata(metadata_file: Path) -> Dict[str, Any]:
+    """Load a TOML or JSON metadata file and check its required fields.
+    
+    Raises ValueError with a user-facing message if it is invalid.
+    """
+    if metadata_file.suffix == ".toml":
+        try:
+            import tomli
+        except ImportError:
+            try:
+                import tomllib as tomli
+            except ImportError:
+                raise ValueError("TOML support requires tomli. Run: pip install tomli")
+        
+        with open(metadata_file, "rb") as f:
+            data = tomli.load(f)
+    
+    elif metadata_file.suffix == ".json":
+        with open(metadata_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    
+    else:
+        raise ValueError(f"Unsupported format: {metadata_file.suffix}")
+    
+    # Validate required fields
+    if "document" not in data:
+        raise ValueError("Missing 'document' section in metadata")
+    
+    if "source_pdf" not in data["document"]:
+        raise ValueError("Missing 'source_pdf' in document section")
+    
+    if "sections" not in data or not data["sections"]:
+        raise ValueError("No sections defined in metadata")
+    
+    return data
 
 
 def main():
@@ -29,43 +67,15 @@ def main():
         sys.exit(1)
     
     try:
-        if metadata_file.suffix == ".toml":
-            try:
-                import tomli
-            except ImportError:
-                try:
-                    import tomllib as tomli
-                except ImportError:
-                    print("ERROR: TOML support requires tomli. Run: pip install tomli", file=sys.stderr)
-                    sys.exit(1)
-            
-            with open(metadata_file, "rb") as f:
-                data = tomli.load(f)
-        
-        elif metadata_file.suffix == ".json":
-            with open(metadata_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        
-        else:
-            print(f"ERROR: Unsupported format: {metadata_file.suffix}", file=sys.stderr)
-            sys.exit(1)
-        
-        # Validate required fields
-        if "document" not in data:
-            print("ERROR: Missing 'document' section in metadata", file=sys.stderr)
-            sys.exit(1)
-        
-        if "source_pdf" not in data["document"]:
-            print("ERROR: Missing 'source_pdf' in document section", file=sys.stderr)
-            sys.exit(1)
-        
-        if "sections" not in data or not data["sections"]:
-            print("ERROR: No sections defined in metadata", file=sys.stderr)
-            sys.exit(1)
+        data = parse_metadata(metadata_file)
         
         # Output as JSON
         print(json.dumps(data, indent=2))
     
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    
     except Exception as e:
         print(f"ERROR: Failed to parse metadata: {e}", file=sys.stderr)
         sys.exit(1)
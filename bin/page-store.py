@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+page-store.py - Per-page extracted text store for source PDFs
+
+Runs `pdftotext -layout` over a whole source PDF once and stores the text of
+every page in a SQLite database named after the PDF's SHA-256, so section
+text for any page range is assembled by lookup instead of re-slicing and
+re-extracting the PDF on every run. A changed PDF gets a new store.
+
+Usage:
+    page-store.py build <pdf> [--store-dir DIR] [--jobs N]
+    page-store.py extract <pdf> --pages START-END [--output FILE] [--store-dir DIR]
+    page-store.py info <pdf> [--store-dir DIR]
+
+`extract` builds the store first if needed and writes the pages exactly as
+pdftotext would for that range (each page followed by a form feed).
+
+Exit codes:
+    0 - Success
+    1 - Error
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+
+# Bump when the extraction command or storage layout changes: old stores are rebuilt
+STORE_VERSION = 1
+EXTRACT_COMMAND = ["pdftotext", "-layout"]
+PAGES_PER_JOB = 100
+
+
+def pdf_sha256(pdf_path: Path) -> str:
+    """SHA-256 of the PDF contents (the store's identity)."""
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cached_pdf_sha256(pdf_path: Path, store_dir: Path) -> str:
+    """pdf_sha256, remembered per (path, size, mtime) in <store_dir>/hashes.json.
+    
+    Hashing a multi-hundred-MB manual takes a while; looking a store up
+    should not.
+    """
+    stat = pdf_path.stat()
+    fingerprint = f"{pdf_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+    hashes_file = store_dir / "hashes.json"
+    try:
+        with open(hashes_file, "r", encoding="utf-8") as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        hashes = {}
+    
+    if fingerprint not in hashes:
+        hashes[fingerprint] = pdf_sha256(pdf_path)
+        store_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = hashes_file.with_name(f"hashes.json.{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(hashes, f, indent=2)
+        os.replace(tmp_file, hashes_file)
+    return hashes[fingerprint]
+
+
+def pdf_page_count(pdf_path: Path) -> int:
+    """Page count from pdfinfo."""
+    result = subprocess.run(["pdfinfo", str(pdf_path)], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"pdfinfo failed: {result.stderr.strip()}")
+    for line in result.stdout.splitlines():
+        if line.startswith("Pages:"):
+            return int(line.split()[1])
+    raise RuntimeError(f"pdfinfo reported no page count for {pdf_path}")
+
+
+def extract_range(pdf_path: Path, first: int, last: int) -> List[str]:
+    """Extract pages first..last with pdftotext; return one string per page."""
+    result = subprocess.run(
+        EXTRACT_COMMAND + ["-f", str(first), "-l", str(last), str(pdf_path), "-"],
+        capture_output=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"pdftotext failed on pages {first}-{last}: "
+                           f"{result.stderr.decode('utf-8', 'replace').strip()}")
+    
+    # pdftotext ends every page with a form feed
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    expected = last - first + 1
+    if len(pages) < expected:
+        raise RuntimeError(f"pdftotext returned {len(pages)} pages for {first}-{last}, expected {expected}")
+    return pages[:expected]
+
+
+class PageStore:
+    """SQLite store of one PDF's per-page text: <store_dir>/<sha256>.sqlite"""
+    
+    def __init__(self, pdf_path: Path, store_dir: Path, sha256: Optional[str] = None):
+        self.pdf_path = pdf_path
+        self.sha256 = sha256 or cached_pdf_sha256(pdf_path, store_dir)
+        self.path = store_dir / f"{self.sha256}.sqlite"
+    
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path)
+    
+    def info(self) -> Optional[Dict[str, Any]]:
+        """Store metadata, or None if the store is missing, incomplete or outdated."""
+        if not self.path.exists():
+            return None
+        try:
+            with self._connect() as db:
+                meta = dict(db.execute("SELECT key, value FROM meta"))
+        except sqlite3.Error:
+            return None
+        if meta.get("complete") != "1" or meta.get("version") != str(STORE_VERSION):
+            return None
+        meta["page_count"] = int(meta["page_count"])
+        meta["path"] = str(self.path)
+        return meta
+    
+    def build(self, jobs: int = 4) -> Dict[str, Any]:
+        """Extract every page of the PDF into the store (no-op if already built)."""
+        info = self.info()
+        if info is not None:
+            return info
+        
+        page_count = pdf_page_count(self.pdf_path)
+        ranges = [(first, min(first + PAGES_PER_JOB - 1, page_count))
+                  for first in range(1, page_count + 1, PAGES_PER_JOB)]
+        print(f"Building page store for {self.pdf_path.name}: {page_count} pages, "
+              f"{len(ranges)} extraction job(s)...", file=sys.stderr)
+        
+        # Build into a temporary file and move it into place when complete
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.unlink(missing_ok=True)
+        try:
+            db = sqlite3.connect(tmp_path)
+            with db:
+                db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                db.execute("CREATE TABLE pages (page INTEGER PRIMARY KEY, text TEXT NOT NULL)")
+                with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+                    extracted = pool.map(lambda r: extract_range(self.pdf_path, *r), ranges)
+                    for (first, _), pages in zip(ranges, extracted):
+                        db.executemany("INSERT INTO pages (page, text) VALUES (?, ?)",
+                                       [(first + i, text) for i, text in enumerate(pages)])
+                db.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+                    ("version", str(STORE_VERSION)),
+                    ("source_pdf", str(self.pdf_path)),
+                    ("sha256", self.sha256),
+                    ("page_count", str(page_count)),
+                    ("extract_command", " ".join(EXTRACT_COMMAND)),
+                    ("created", datetime.now().isoformat()),
+                    ("complete", "1")
+                ])
+            db.close()
+            os.replace(tmp_path, self.path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        
+        print(f"Page store saved to {self.path}", file=sys.stderr)
+        return self.info()
+    
+    def pages(self, first: int, last: int) -> List[Tuple[int, str]]:
+        """(page, text) for pages first..last."""
+        with self._connect() as db:
+            rows = db.execute("SELECT page, text FROM pages WHERE page BETWEEN ? AND ? ORDER BY page",
+                              (first, last)).fetchall()
+        if len(rows) != last - first + 1:
+            raise RuntimeError(f"Pages {first}-{last} not in store (document has "
+                               f"{self.info()['page_count']} pages)")
+        return rows
+
+
+def parse_page_range(value: str) -> Tuple[int, int]:
+    """Parse "START-END" (or a single page)."""
+    first, _, last = value.partition("-")
+    first_page, last_page = int(first), int(last or first)
+    if first_page < 1 or last_page < first_page:
+        raise argparse.ArgumentTypeError(f"Invalid page range: {value}")
+    return first_page, last_page
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Per-page extracted text store for source PDFs"
+    )
+    parser.add_argument("command", choices=["build", "extract", "info"],
+                        help="build the store, extract a page range, or show store info")
+    parser.add_argument("pdf", type=Path, help="Source PDF")
+    parser.add_argument("--store-dir", type=Path,
+                        default=Path(os.getenv("PAGE_STORE_DIR", ".page-store")),
+                        help="Directory holding page stores (default: .page-store)")
+    parser.add_argument("--pages", type=parse_page_range,
+                        help="extract: page range START-END")
+    parser.add_argument("--output", type=Path,
+                        help="extract: output text file (default: stdout)")
+    parser.add_argument("--jobs", type=int, default=int(os.getenv("PAGE_STORE_JOBS", "4")),
+                        help="build: parallel pdftotext processes (default: 4)")
+    
+    args = parser.parse_args()
+    
+    if not args.pdf.exists():
+        print(f"ERROR: PDF not found: {args.pdf}", file=sys.stderr)
+        sys.exit(1)
+    
+    try:
+        store = PageStore(args.pdf, args.store_dir)
+        
+        if args.command == "info":
+            info = store.info()
+            if info is None:
+                print(f"No page store for {args.pdf} (expected {store.path})", file=sys.stderr)
+                sys.exit(1)
+            print(json.dumps(info))
+        
+        elif args.command == "build":
+            print(json.dumps(store.build(args.jobs)))
+        
+        elif args.command == "extract":
+            if args.pages is None:
+                print("ERROR: extract requires --pages START-END", file=sys.stderr)
+                sys.exit(1)
+            store.build(args.jobs)
+            text = "".join(f"{page_text}\f" for _, page_text in store.pages(*args.pages))
+            if args.output:
+                with open(args.output, "w", encoding="utf-8") as f:
+                    f.write(text)
+            else:
+                sys.stdout.write(text)
+    
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
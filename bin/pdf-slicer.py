@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+pdf-slicer.py - Slice every section of a source PDF in one pass
+
+Writes one PDF per section (page range) while parsing the source PDF once,
+instead of running `qpdf --pages` over the whole manual for every section:
+the source is opened once with pikepdf (qpdf's library) and every section's
+pages are copied out of it. pikepdf is installed and checked by
+doc-tools-install.sh.
+
+Usage:
+    pdf-slicer.py <pdf> --slice START-END:OUTPUT [--slice ...]
+
+Exit codes:
+    0 - Success
+    1 - Error
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+# In-process PDF library (pip install pikepdf; installed by doc-tools-install.sh)
+try:
+    import pikepdf
+    PIKEPDF_AVAILABLE = True
+except ImportError:
+    PIKEPDF_AVAILABLE = False
+
+
+Slice = Tuple[int, int, Path]  # (first_page, last_page, output_pdf)
+
+
+def slice_pdf(source_pdf: Path, slices: List[Slice]):
+    """Write every slice of source_pdf, copied out of one parse of the source."""
+    if not PIKEPDF_AVAILABLE:
+        raise RuntimeError("PDF slicing requires pikepdf. Run: pip install pikepdf "
+                           "(or bin/doc-tools-install.sh)")
+    
+    for directory in {output_pdf.parent for _, _, output_pdf in slices}:
+        directory.mkdir(parents=True, exist_ok=True)
+    
+    with pikepdf.open(source_pdf) as pdf:
+        for first, last, output_pdf in slices:
+            if last > len(pdf.pages):
+                raise RuntimeError(f"Pages {first}-{last} out of range ({source_pdf.name} has "
+                                   f"{len(pdf.pages)} pages)")
+            section = pikepdf.new()
+            section.pages.extend(pdf.pages[first - 1:last])
+            section.save(output_pdf)
+
+
+def parse_slice(value: str) -> Slice:
+    """Parse "START-END:OUTPUT"."""
+    pages, sep, output = value.partition(":")
+    first, _, last = pages.partition("-")
+    try:
+        first_page, last_page = int(first), int(last or first)
+    except ValueError:
+        first_page = last_page = 0
+    if not sep or not output or first_page < 1 or last_page < first_page:
+        raise argparse.ArgumentTypeError(f"Invalid slice (expected START-END:OUTPUT): {value}")
+    return first_page, last_page, Path(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Slice every section of a source PDF in one pass"
+    )
+    parser.add_argument("pdf", type=Path, help="Source PDF")
+    parser.add_argument("--slice", dest="slices", type=parse_slice, action="append", required=True,
+                        help="Pages and output file, START-END:OUTPUT (repeatable)")
+    
+    args = parser.parse_args()
+    
+    if not args.pdf.exists():
+        print(f"ERROR: PDF not found: {args.pdf}", file=sys.stderr)
+        sys.exit(1)
+    
+    try:
+        slice_pdf(args.pdf, args.slices)
+        print(f"Sliced {len(args.slices)} section(s) from {args.pdf.name}", file=sys.stderr)
+    
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
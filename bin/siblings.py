@@ -0,0 +1,37 @@
+"""
+siblings.py - Load the other bin/ scripts as modules
+
+The bin/ scripts have hyphenated names (doc-ai-processor.py, index-merge.py,
+...), so they can't be imported with an import statement. load_sibling
+imports one by path and registers it in sys.modules, so every script in
+the process (doc-digest.py, chunk-planner.py, doc-ai-processor.py) shares
+one copy of each sibling and none is executed twice.
+
+Scripts import it as `from siblings import load_sibling`: Python puts the
+running script's directory (bin/) on sys.path.
+"""
+
+import importlib.util
+import sys
+import threading
+from pathlib import Path
+
+BIN_DIR = Path(__file__).resolve().parent
+
+_lock = threading.RLock()  # (re-entrant: a sibling may load siblings while it is loaded)
+
+
+def load_sibling(name: str):
+    """Import a hyphenated sibling script (e.g. index-merge.py) as a module, once."""
+    module_name = name.replace("-", "_")
+    with _lock:
+        if module_name not in sys.modules:
+            spec = importlib.util.spec_from_file_location(module_name, BIN_DIR / f"{name}.py")
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[module_name]
+                raise
+        return sys.modules[module_name]
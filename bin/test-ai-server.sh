@@ -0,0 +1,75 @@
+#!/bin/bash
+# test-ai-server.sh - Integration test for the connection test of doc-ai-processor.py --serve
+# Uses a local stand-in provider (batch-api-stub.py): no API key, no costs
+#
+# The server keeps a response cache, but its /test-connection endpoint must
+# reach the provider every time: once the provider is gone, it has to report
+# 502 rather than replay the earlier "OK" from the cache.
+#
+# Usage: test-ai-server.sh [work-dir]
+#   Example: ./bin/test-ai-server.sh /tmp/ai-server-test
+
+set -euo pipefail
+
+scriptName="${scriptName:-"$(command readlink -f -- "$0")"}"
+scriptDir="$(command dirname -- "${scriptName}")"
+
+die() {
+    echo "ERROR: $*" >&2
+    exit 1
+}
+
+WORK_DIR="${1:-$(mktemp -d)}"
+mkdir -p "$WORK_DIR"
+
+free_port() {
+    python -c 'import socket; s = socket.socket(); s.bind(("127.0.0.1", 0)); print(s.getsockname()[1])'
+}
+STUB_PORT="$(free_port)"
+SERVER_PORT="$(free_port)"
+SERVER_URL="http://127.0.0.1:$SERVER_PORT"
+
+echo "=== Integration Test: AI server connection test ==="
+echo "Work dir: $WORK_DIR"
+echo
+
+python "$scriptDir/batch-api-stub.py" --listen "127.0.0.1:$STUB_PORT" 2> "$WORK_DIR/stub.log" &
+STUB_PID=$!
+ANTHROPIC_API_KEY=stub-key AI_STREAM= python "$scriptDir/doc-ai-processor.py" --serve \
+    --listen "127.0.0.1:$SERVER_PORT" --provider anthropic --base-url "http://127.0.0.1:$STUB_PORT" \
+    --cache-dir "$WORK_DIR/.ai-cache" --max-retries 0 2> "$WORK_DIR/server.log" &
+SERVER_PID=$!
+trap 'kill "$STUB_PID" "$SERVER_PID" 2>/dev/null || true' EXIT
+
+for _ in $(seq 50); do
+    curl -sf "$SERVER_URL/health" > /dev/null && break
+    sleep 0.1
+done
+curl -sf "$SERVER_URL/health" > /dev/null || die "Server did not start (see $WORK_DIR/server.log)"
+
+# Prints the HTTP status, saves the body to $WORK_DIR/<name>.json
+test_connection() {
+    curl -s -o "$WORK_DIR/$1.json" -w '%{http_code}' -X POST "$SERVER_URL/test-connection"
+}
+
+# Test 1: provider reachable
+echo "=== Test 1: Provider reachable ==="
+status="$(test_connection reachable)"
+[[ "$status" == 200 ]] || die "Expected HTTP 200, got $status ($(cat "$WORK_DIR/reachable.json"))"
+jq -e '.success' "$WORK_DIR/reachable.json" > /dev/null || die "Connection test did not succeed"
+echo "✓ Connection test succeeded"
+echo
+
+# Test 2: provider gone -- the earlier OK must not come from the cache
+echo "=== Test 2: Provider unreachable ==="
+kill "$STUB_PID"
+wait "$STUB_PID" 2>/dev/null || true
+status="$(test_connection unreachable)"
+[[ "$status" == 502 ]] || die "Expected HTTP 502, got $status ($(cat "$WORK_DIR/unreachable.json"))"
+jq -e '.success == false' "$WORK_DIR/unreachable.json" > /dev/null || die "Connection test reported success"
+echo "✓ Connection test failed with 502: $(jq -r '.error' "$WORK_DIR/unreachable.json")"
+echo
+
+curl -s -X POST "$SERVER_URL/shutdown" > /dev/null || true
+
+echo "=== All tests passed! ==="
@@ -33,7 +33,8 @@ echo
 
 # Look for generated digest and index files
 DIGEST_FILES=($(find "$PROJECT_DIR" -name "*.digest.*.md" 2>/dev/null || true))
-INDEX_FILES=($(find "$PROJECT_DIR" -name "*.index.*.json" 2>/dev/null || true))
+INDEX_FILES=($(find "$PROJECT_DIR" \( -name "*.index.*.json" -o -name "*.index.*.jsonl" \
+    -o -name "*.index.*.msgpack" -o -name "*.index.*.cbor" \) 2>/dev/null || true))
 
 if [[ ${#DIGEST_FILES[@]} -eq 0 ]]; then
     die "No digest files found in $PROJECT_DIR"
@@ -89,28 +90,18 @@ echo "  index_file: $INDEX_FILE"
 echo "  char_count: $CHAR_COUNT"
 echo
 
-# Test 2: Generate master index
-echo "=== Test 2: Generate master index ==="
+# Test 2: Generate master index and quick reference
+echo "=== Test 2: Generate master index and quick reference ==="
 
-# Source the functions from doc-digest.sh by setting sourceMe variable
-export sourceMe=1
-source "$scriptDir/doc-digest.sh"
-
-OUTPUT_DIR="$PROJECT_DIR"
-if ! generate_master_index "$SOURCE_NAME" "${INDEX_FILES[@]}"; then
-    die "Master index generation failed"
+# Same code path as the pipeline's final stage (doc-digest.py), without the AI step
+if ! python "$scriptDir/doc-digest.py" --artifacts-only \
+    --output-dir "$PROJECT_DIR" --source-name "$SOURCE_NAME"; then
+    die "Artifact generation failed"
 fi
 echo "✓ Master index generated"
-echo
-
-# Test 3: Generate quick reference
-echo "=== Test 3: Generate quick reference ==="
-if ! generate_quick_reference "$SOURCE_NAME" "${DIGEST_FILES[@]}"; then
-    die "Quick reference generation failed"
-fi
 echo "✓ Quick reference generated"
 echo
 
 echo "=== All tests passed! ==="
 echo "Generated files in: $PROJECT_DIR"
-ls -lh "$PROJECT_DIR"/*.master-index.json "$PROJECT_DIR"/*.quick-reference.md 2>/dev/null || true
+ls -lh "$PROJECT_DIR"/*.master-index.* "$PROJECT_DIR"/*.quick-reference.md 2>/dev/null || true